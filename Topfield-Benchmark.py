@@ -0,0 +1,542 @@
+#!/usr/bin/env python2
+# Mark Blakeney, Mar 2010.
+
+'''
+Benchmarks for Topfield-Launcher. Run from the source directory
+alongside Topfield-Launcher.py. Network benchmarks run against a local
+stand-in for ftpd-topfield serving synthetic directories.
+'''
+
+PROG = 'Topfield-Launcher.py'
+
+# Sizes of synthetic directories to benchmark
+SIZES = (10, 100, 1000, 10000, 100000)
+
+# Files deleted and renamed in each batch round trip benchmark
+BATCH = 50
+
+import sys, os
+import imp
+import random
+import timeit
+import time
+import platform
+import argparse
+import json
+import socket
+import threading
+import SocketServer
+from datetime import timedelta
+
+def load():
+    '''Load the launcher as a module'''
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), PROG)
+    return imp.load_source('launcher', path)
+
+class Node:
+    '''File or directory in the stand-in server tree'''
+    def __init__(self, name, isdir=False, size=0, mtime=None):
+        self.name = name
+        self.isdir = isdir
+        self.size = size
+        self.mtime = mtime or time.time()
+        self.children = {}
+
+        # Formatted LIST and MLSD output, kept until dir changes
+        self.listings = {}
+
+    def line(self):
+        '''Return LIST line as ftpd-topfield formats it, with the name
+        always at column 59'''
+        if time.time() - self.mtime < 180 * 24 * 3600:
+            date = time.strftime('%b %d %H:%M', time.localtime(self.mtime))
+        else:
+            date = time.strftime('%b %d  %Y', time.localtime(self.mtime))
+
+        return '%s %4d %-8s %-8s %11d %s %s' % ('drwxr-xr-x' if
+                self.isdir else '-rwxr-xr-x', 1, 'root', 'root', self.size,
+                date, self.name)
+
+    def facts(self, type=None):
+        '''Return MLSD line'''
+        return 'type=%s;size=%d;modify=%s; %s' % (type or ('dir' if
+            self.isdir else 'file'), self.size, time.strftime(
+                '%Y%m%d%H%M%S', time.gmtime(self.mtime)), self.name)
+
+class FTPHandler(SocketServer.BaseRequestHandler):
+    '''Stand-in ftpd-topfield session. Only the commands the launcher
+    uses are implemented.'''
+
+    def reply(self, text):
+        '''Send reply line'''
+        self.request.sendall(text + '\r\n')
+
+    def handle(self):
+        '''Read and action commands until client quits. Latency is
+        injected once for each read from the client, like a network
+        round trip, so commands which arrive together (pipelined) only
+        pay it once.'''
+        self.cwd = '/'
+        self.rest = 0
+        self.rnfr = None
+        self.pasv = None
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reply('220 Stand-in ftpd-topfield')
+
+        buf = ''
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            if self.server.latency:
+                time.sleep(self.server.latency)
+
+            buf += data
+            while '\n' in buf:
+                line, buf = buf.split('\n', 1)
+                cmd, _, arg = line.strip().partition(' ')
+                func = getattr(self, 'do_' + cmd.upper(), None)
+                if not func:
+                    self.reply('502 Command not implemented')
+                elif func(arg):
+                    return
+
+    def path(self, arg):
+        '''Return absolute path of argument'''
+        if arg.startswith('/'):
+            return arg
+        return self.cwd.rstrip('/') + '/' + arg
+
+    def node(self, arg):
+        '''Return (parent node, node) of argument path, or (None, None)'''
+        parent = None
+        node = self.server.root
+        for part in [p for p in self.path(arg).split('/') if p]:
+            parent = node
+            node = node.children.get(part)
+            if not node:
+                return None, None
+        return parent, node
+
+    def data(self):
+        '''Accept data connection'''
+        sock, addr = self.pasv.accept()
+        self.pasv.close()
+        self.pasv = None
+        return sock
+
+    def do_USER(self, arg):
+        self.reply('331 Password required')
+
+    def do_PASS(self, arg):
+        self.reply('230 Logged in')
+
+    def do_NOOP(self, arg):
+        self.reply('200 OK')
+
+    def do_TYPE(self, arg):
+        self.reply('200 Type set')
+
+    def do_FEAT(self, arg):
+        if not self.server.mlsd:
+            self.reply('500 Command not understood')
+            return
+        self.reply('211-Features:\r\n MLSD\r\n SIZE\r\n MDTM\r\n211 End')
+
+    def do_QUIT(self, arg):
+        self.reply('221 Goodbye')
+        return True
+
+    def do_CWD(self, arg):
+        parent, node = self.node(arg)
+        if not node or not node.isdir:
+            self.reply('550 No such directory')
+            return
+        self.cwd = self.path(arg)
+        self.reply('250 OK')
+
+    def do_REST(self, arg):
+        self.rest = int(arg)
+        self.reply('350 Restarting')
+
+    def do_SIZE(self, arg):
+        parent, node = self.node(arg)
+        if not node:
+            self.reply('550 No such file')
+            return
+        self.reply('213 %d' % node.size)
+
+    def do_MDTM(self, arg):
+        parent, node = self.node(arg)
+        if not node:
+            self.reply('550 No such file')
+            return
+        self.reply('213 ' + time.strftime('%Y%m%d%H%M%S',
+            time.gmtime(node.mtime)))
+
+    def do_DELE(self, arg):
+        parent, node = self.node(arg)
+        if not node or node.isdir:
+            self.reply('550 No such file')
+            return
+        del parent.children[node.name]
+        parent.listings.clear()
+        self.reply('250 Deleted')
+
+    def do_RNFR(self, arg):
+        parent, node = self.node(arg)
+        if not node:
+            self.reply('550 No such file')
+            return
+        self.rnfr = (parent, node)
+        self.reply('350 Ready for RNTO')
+
+    def do_RNTO(self, arg):
+        if not self.rnfr:
+            self.reply('503 Need RNFR first')
+            return
+        parent, node = self.rnfr
+        self.rnfr = None
+        del parent.children[node.name]
+        node.name = arg.rsplit('/', 1)[-1]
+        parent.children[node.name] = node
+        parent.listings.clear()
+        self.reply('250 Renamed')
+
+    def do_PASV(self, arg):
+        self.pasv = socket.socket()
+        self.pasv.bind(('127.0.0.1', 0))
+        self.pasv.listen(1)
+        port = self.pasv.getsockname()[1]
+        self.reply('227 Entering Passive Mode (127,0,0,1,%d,%d)' %
+                (port >> 8, port & 255))
+
+    def do_LIST(self, arg):
+        parent, node = self.node(self.cwd)
+        if 'LIST' not in node.listings:
+            lines = [Node('..', True).line()] + [x.line()
+                    for x in node.children.values()]
+            node.listings['LIST'] = ''.join(l + '\r\n' for l in lines)
+        self.send(node.listings['LIST'])
+
+    def do_MLSD(self, arg):
+        parent, node = self.node(self.cwd)
+        if 'MLSD' not in node.listings:
+            lines = [node.facts('cdir')] + [x.facts()
+                    for x in node.children.values()]
+            node.listings['MLSD'] = ''.join(l + '\r\n' for l in lines)
+        self.send(node.listings['MLSD'])
+
+    def send(self, data):
+        '''Send data on data connection'''
+        self.reply('150 Opening data connection')
+        sock = self.data()
+        sock.sendall(data)
+        sock.close()
+        self.reply('226 Transfer complete')
+
+    def do_RETR(self, arg):
+        parent, node = self.node(arg)
+        if not node or node.isdir:
+            self.reply('550 No such file')
+            return
+        offset = self.rest
+        self.rest = 0
+        self.reply('150 Opening data connection')
+        sock = self.data()
+        try:
+            # Byte at each offset is offset & 255, so resumed and
+            # segmented reads see the same data as a whole file read
+            block = ''.join(chr(i & 255) for i in range(65536 + 256))
+            while offset < node.size:
+                start = offset & 255
+                n = min(len(block) - 256, node.size - offset)
+                sock.sendall(block[start:start + n])
+                offset += n
+            sock.close()
+            self.reply('226 Transfer complete')
+        except socket.error:
+            sock.close()
+            self.reply('426 Transfer aborted')
+
+class FTPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    '''Local stand-in ftpd-topfield server, with a tree of synthetic
+    files and optional latency injected as commands arrive'''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0, mlsd=False):
+        SocketServer.TCPServer.__init__(self, ('127.0.0.1', 0), FTPHandler)
+        self.latency = latency
+        self.mlsd = mlsd
+        self.root = Node('', True)
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    @property
+    def host(self):
+        '''Host:port for launcher to connect to'''
+        return '%s:%d' % self.server_address
+
+    def add(self, path, size=0, isdir=False, mtime=None):
+        '''Add file or dir node, creating parent dirs as needed'''
+        parts = [p for p in path.split('/') if p]
+        node = self.root
+        for part in parts[:-1]:
+            node = node.children.setdefault(part, Node(part, True))
+        node.children[parts[-1]] = Node(parts[-1], isdir, size, mtime)
+        node.listings.clear()
+
+    def populate(self, dir, count):
+        '''Add synthetic dir of count recordings, a few subdirs and some
+        zero size recordings in progress'''
+        random.seed(count)
+        now = time.time()
+        for i in range(min(count // 100, 20)):
+            self.add('%s/Folder %02d' % (dir, i), isdir=True)
+        for i in range(count):
+            size = random.randint(100, 4 * 1024) * 1024 * 1024
+            if i % 500 == 0:
+                size = 0
+            self.add('%s/Show %06d.rec' % (dir, i), size,
+                    mtime=now - random.randint(0, 2 * 365 * 24 * 3600))
+
+def datestrs(tl, count):
+    '''Generate LIST date strings as ftpd-topfield reports them'''
+    random.seed(1)
+    strs = []
+    for i in range(count):
+        date = tl.timenow - timedelta(minutes=random.randint(0, 2 * 365 * 24
+            * 60))
+
+        # Most recordings are within the last 6 months so are reported
+        # with a time instead of a year.
+        if tl.timenow - date < timedelta(days=180):
+            strs.append(date.strftime('%b %d %H:%M'))
+        else:
+            strs.append(date.strftime('%b %d  %Y'))
+
+    return strs
+
+def listlines(tl, count):
+    '''Generate LIST file lines as ftpd-topfield reports them'''
+    random.seed(2)
+    return ['-rwxr-xr-x    1 root     root    %11d %s Show %06d.rec' %
+            (random.randint(0, 4 * 1024 ** 3), s, i)
+            for i, s in enumerate(datestrs(tl, count))]
+
+def deepsize(objs):
+    '''Return total size of objects and everything they refer to,
+    counting shared objects once'''
+    seen = set()
+    total = 0
+    stack = list(objs)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for slot in getattr(type(obj), '__slots__', ()):
+            stack.append(getattr(obj, slot))
+
+    return total
+
+def mlsdlines(tl, count):
+    '''Generate MLSD lines for the same files as listlines()'''
+    lines = []
+    for line in listlines(tl, count):
+        ent = tl.Entries.parse(tl.BASEDIR, line)
+        node = Node(tl.basename('/' + ent.path), size=ent.bytes,
+                mtime=time.mktime(ent.date.timetuple()))
+        lines.append(node.facts())
+    return lines
+
+def best(func, repeat=3):
+    '''Return best time in secs of func over repeat runs'''
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+def result(name, count, secs, **extra):
+    '''Print and return a benchmark result'''
+    print '  %-22s %7d  %10.2f ms  %8.2f us/item' % (name, count,
+            secs * 1000, secs * 1e6 / max(count, 1))
+    extra.update(name=name, count=count, secs=secs)
+    return extra
+
+class OldEntry:
+    '''Entry as originally stored, with preformatted strings'''
+    def __init__(self, path, dir, display, datestr='', size=''):
+        self.path = path
+        self.dir = dir
+        self.display = display
+        self.datestr = datestr
+        self.size = size
+
+def bench_memory(tl, count=100000):
+    '''Compare memory used by listing entries against original model'''
+    lines = listlines(tl, count)
+    new = tl.Entries('localhost', tl.BASEDIR).build(lines)
+
+    old = []
+    for x in new:
+        ent = OldEntry(x.path, '', x.display, x.datestr, x.size)
+        ent.date = x.date
+        old.append(ent)
+
+    print 'Entries, %d files:' % count
+    results = []
+    base = deepsize(old)
+    for name, entries in (('dict', old), ('slots', new)):
+        size = deepsize(entries)
+        print '  %-6s %8.1f MB  %6.1f bytes/entry  %5.2fx' % (name,
+                size / (1024. ** 2), float(size) / count, float(base) / size)
+        results.append(dict(name='memory.' + name, count=count, bytes=size))
+
+    return results
+
+def bench_dates(tl, count=5000):
+    '''Compare LIST date parsing against original fuzzy parsing'''
+    strs = datestrs(tl, count)
+
+    def fuzzy():
+        for s in strs:
+            tl.compute_date_fuzzy(s)
+
+    def fast():
+        tl.datecache.clear()
+        for s in strs:
+            tl.compute_date(s)
+
+    def memo():
+        for s in strs:
+            tl.compute_date(s)
+
+    # Check fast parser gives same results as original
+    for s in strs:
+        assert tl.parse_date(s) == tl.compute_date_fuzzy(s), s
+
+    print 'compute_date, %d dates:' % count
+    return [result('compute_date.' + name, count, best(func))
+            for name, func in (('fuzzy', fuzzy), ('fast', fast),
+                ('memo', memo))]
+
+def bench_parse(tl, count=100000):
+    '''Compare LIST and MLSD line parse throughput'''
+    print 'Parse, %d lines:' % count
+    results = []
+    for name, lines in (('list', listlines(tl, count)),
+            ('mlsd', mlsdlines(tl, count))):
+        def parse():
+            tl.datecache.clear()
+            for line in lines:
+                tl.Entries.parse(tl.BASEDIR, line)
+
+        results.append(result('parse.' + name, count, best(parse)))
+
+    return results
+
+def bench_listing(tl, server, sizes):
+    '''Time fetching, building and rendering synthetic directories of
+    each size'''
+    print 'Listings, %s, latency %.0f ms:' % ('MLSD' if server.mlsd else
+            'LIST', server.latency * 1000)
+    results = []
+    prefix = 'mlsd.' if server.mlsd else 'listing.'
+    for count in sizes:
+        dir = '/DataFiles/Bench%d' % count
+        server.populate(dir, count)
+        url = tl.makeurl(server.host, dir)
+
+        lines = []
+        def fetch():
+            lines[:] = tl.fetch(url)[0]
+
+        def build():
+            tl.datecache.clear()
+            entries[:] = tl.Entries(server.host, dir).build(lines)
+
+        # Produce the text of every cell, as the virtual list control
+        # does for each row drawn
+        columns = ('display', 'datestr', 'size', 'channel', 'length',
+                'description')
+        def render():
+            for x in entries:
+                for col in columns:
+                    getattr(x, col)
+
+        entries = []
+        results.append(result(prefix + 'fetch', count, best(fetch)))
+        results.append(result(prefix + 'build', count, best(build)))
+        if not server.mlsd:
+            results.append(result(prefix + 'render', count, best(render)))
+
+    return results
+
+def bench_batch(tl, server, count=BATCH):
+    '''Time batch delete and rename round trips, with and without
+    pipelining'''
+    print 'Batch commands, %d files, latency %.0f ms:' % (count,
+            server.latency * 1000)
+    results = []
+    for pipeline in (False, True):
+        dir = '/DataFiles/Batch%d' % pipeline
+        server.populate(dir, count)
+        paths = ['%s/Show %06d.rec' % (dir, i) for i in range(count)]
+        suffix = '.pipelined' if pipeline else ''
+
+        start = time.time()
+        errors = tl.rename(server.host, dir, [(p, 'New %06d.rec' % i)
+            for i, p in enumerate(paths)], pipeline)
+        assert not any(errors), errors
+        results.append(result('batch.rename' + suffix, count,
+            time.time() - start))
+
+        paths = ['%s/New %06d.rec' % (dir, i) for i in range(count)]
+        start = time.time()
+        errors = tl.delete(server.host, paths, pipeline)
+        assert not any(errors), errors
+        results.append(result('batch.delete' + suffix, count,
+            time.time() - start))
+
+    return results
+
+def main():
+    '''Run all benchmarks'''
+    opt = argparse.ArgumentParser(description=__doc__)
+    opt.add_argument('-s', '--sizes', default=','.join(str(s) for s in SIZES),
+            help='comma separated synthetic dir sizes, default %(default)s')
+    opt.add_argument('-l', '--latency', type=float, default=0,
+            help='ms of round trip latency injected by server')
+    opt.add_argument('-o', '--output',
+            help='write results as JSON to this file')
+    args = opt.parse_args()
+
+    tl = load()
+    server = FTPServer(args.latency / 1000)
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    results = []
+    results += bench_dates(tl)
+    results += bench_memory(tl, max(sizes))
+    results += bench_parse(tl, max(sizes))
+    results += bench_listing(tl, server, sizes)
+    results += bench_listing(tl, FTPServer(server.latency, mlsd=True), sizes)
+    results += bench_batch(tl, server)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(version=tl.VERSION, time=time.time(),
+                python=platform.python_version(), latency=args.latency,
+                results=results), f, indent=1)
+
+if __name__ == '__main__':
+    sys.exit(main())
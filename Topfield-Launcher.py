@@ -51,20 +51,151 @@ MAXTITLE = 57 #chars
 # Size of bottom select, close buttons
 BUTTON_SIZE = (90, 35)
 
+# Timeout on ftp connections to the PVR
+TIMEOUT = 5 #secs
+
+# Idle pooled ftp connections are sent a NOOP this often to keep them
+# alive, and are checked with a NOOP before reuse if idle for longer.
+KEEPALIVE = 30 #secs
+
+# Max idle ftp connections kept open per host
+MAXIDLE = 4
+
+# Batch deletes and renames are sent over one ftp session. If PIPELINE
+# is set then the commands for up to PIPELINE_DEPTH files are sent before
+# reading their replies. Not all servers allow this so it is off by
+# default, but can be set with the "pipeline" config setting.
+PIPELINE = False
+PIPELINE_DEPTH = 32
+
+# Number of list rows posted to the gui at a time from background
+# population
+BATCH = 200
+
+# Cached directory listings are shown immediately but are refetched in
+# the background if older than this. Can be changed with the "cachettl"
+# config setting.
+CACHE_TTL = 60 #secs
+
+# Max number of directory listings cached
+CACHE_SIZE = 50
+
+# Time a stopped player is given to exit before it is killed
+STOP_WAIT = 3 #secs
+
+# Local streaming proxy reads files from the PVR in chunks of this size,
+# keeps up to CHUNK_CACHE bytes of recently read chunks, and reads up to
+# READAHEAD chunks ahead of the player.
+CHUNK_SIZE = 512 * 1024 #bytes
+CHUNK_CACHE = 64 * 1024 * 1024 #bytes
+READAHEAD = 8 #chunks
+
+# Downloads are fetched in this many segments in parallel, each over its
+# own ftp connection
+SEGMENTS = 4
+
+# Max total size of downloaded recordings kept locally. Can be changed
+# with the "downloadsize" config setting (in MB).
+DOWNLOAD_SIZE = 20 * 1024 #MB
+
+# Max number of directories listed at once when indexing the library
+INDEX_WORKERS = 3
+
+# Subdirs and parent of each listed directory are listed ahead of time
+# in the background, by up to PREFETCH_WORKERS at once and at most
+# PREFETCH_MAX dirs per listing
+PREFETCH_WORKERS = 2
+PREFETCH_MAX = 8
+
+# Recordings in progress are polled every MONITOR_MIN secs, backing off
+# to MONITOR_MAX while they do not change. A recording which has not
+# changed for MONITOR_DONE secs is taken as finished.
+MONITOR_MIN = 5 #secs
+MONITOR_MAX = 60 #secs
+MONITOR_DONE = 180 #secs
+
+# A recording in progress is streamed by polling for growth every
+# TAIL_POLL secs, after first buffering TAIL_BUFFER bytes. Can be changed
+# with the "tailpoll" (secs) and "tailbuffer" (KB) config settings.
+TAIL_POLL = 2 #secs
+TAIL_BUFFER = 2 * 1024 * 1024 #bytes
+
+# Programme details are read from the first PROBE_SIZE bytes of each
+# displayed recording, by up to PROBE_WORKERS at once. The last
+# PROBE_CACHE headers read are kept in memory.
+PROBE_SIZE = 4 * 1024 #bytes
+PROBE_WORKERS = 2
+PROBE_CACHE = 5000
+
+# Several launchers can share one listing cache daemon, run with the
+# "serve" command, which is then the only client listing the PVR. It
+# listens on DAEMON_PORT by default and relists the dirs its clients are
+# showing every DAEMON_POLL secs to tell them of changes. Launchers use
+# it if the "daemon" config setting is set to its host[:port].
+DAEMON_PORT = 8021
+DAEMON_POLL = 60 #secs
+DAEMON_TIMEOUT = 60 #secs
+
+# Timings of the last TIMING_SAMPLES of each phase of an operation are
+# kept for diagnostics. Each timing can also be traced to a JSON lines
+# file, set with the "trace" config setting.
+TIMING_SAMPLES = 200
+
+# Dirs are listed with MLSD if the server says it supports it, giving
+# exact sizes and times, else with LIST. Can be disabled with the "mlsd"
+# config setting.
+MLSD = True
+
+# Every ftp data transfer is scheduled in one of these classes, highest
+# priority first. At most MAX_TRANSFERS transfers are open to each host
+# at once, of which one is kept for playback and listings.
+PRIO_PLAY, PRIO_LIST, PRIO_DOWNLOAD, PRIO_PROBE = range(4)
+PRIO_NAMES = ('play', 'list', 'download', 'probe')
+MAX_TRANSFERS = 4
+
+# Transfers in each class are rate limited to these KB/s, 0 being
+# unlimited. Downloads and probes are held to YIELD_RATE while anything
+# is playing. Can be changed with the "downloadrate", "proberate" and
+# "yieldrate" config settings (in KB/s).
+RATES = (0, 0, 0, 256) #KB/s
+YIELD_RATE = 256 #KB/s
+
+# Duplicate recordings are found among files of the same size by
+# comparing a hash of DEDUP_SAMPLES (at least 2) ranges of
+# DEDUP_SAMPLE_SIZE bytes spread through each, read by up to
+# DEDUP_WORKERS at once.
+DEDUP_SAMPLES = 4
+DEDUP_SAMPLE_SIZE = 16 * 1024 #bytes
+DEDUP_WORKERS = 2
+
 import sys, os, re
 import subprocess
 import platform
-import urllib2
 import urlparse
 import ftplib
-import wx
-from wx.lib.mixins.listctrl import ListCtrlAutoWidthMixin
-
-# Get current time
+import socket
+import threading
+import time
+import urllib
+import BaseHTTPServer
+import SocketServer
+import Queue
+import sqlite3
+import bisect
+import calendar
+import struct
+import hashlib
+import argparse
+import json
+import cProfile
+import pstats
+from collections import OrderedDict, namedtuple, deque
+
+# Get current time, which is updated by settime() before each listing
+# is built. The gui toolkit and fuzzy date parser are only imported when
+# needed, so command line use starts quickly.
 from datetime import datetime
-from dateutil import parser, relativedelta
 timenow = datetime.now()
-lastyear = timenow + relativedelta.relativedelta(years=-1)
 
 def get_default_player():
     '''Get the default player dependent on platform'''
@@ -73,9 +204,86 @@ def get_default_player():
 
     return PLAYER_Linux
 
+def get_default_cachedir():
+    '''Get the default local cache dir dependent on platform'''
+    if platform.system() == "Windows":
+        return os.path.join(os.environ.get('LOCALAPPDATA',
+            os.path.expanduser('~')), NAME)
+
+    return os.path.join(os.path.expanduser('~'), '.cache', NAME)
+
+# Month abbreviations used in ftp LIST dates
+MONTHS = dict((m, i + 1) for i, m in enumerate(
+    'Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec'.split()))
+
+# Memo of computed dates, keyed by LIST date string
+datecache = {}
+
+# Max number of date strings memoised
+DATECACHE_SIZE = 10000
+
+def settime():
+    '''Update current time used to correct listed dates. Dates memoised
+    at an earlier minute may have been corrected wrongly so are
+    discarded.'''
+    global timenow
+    now = datetime.now()
+    if now.replace(second=0, microsecond=0) != timenow.replace(second=0,
+            microsecond=0):
+        datecache.clear()
+    timenow = now
+
 def compute_date(datestr):
+    '''Determine date from Topfield'''
+    date = datecache.get(datestr)
+    if date is None:
+
+        # Use our fast parser, falling back to fuzzy parse if the string
+        # is not in a format we recognise
+        date = parse_date(datestr) or compute_date_fuzzy(datestr)
+
+        if len(datecache) >= DATECACHE_SIZE:
+            datecache.clear()
+        datecache[datestr] = date
+
+    return date
+
+def parse_date(datestr):
+    '''Fast parse of fixed "Mon DD HH:MM" and "Mon DD  YYYY" dates.
+    Returns None if datestr is not in one of those formats.'''
+    fields = datestr.split()
+    if len(fields) != 3:
+        return None
+
+    mon, day, rest = fields
+    month = MONTHS.get(mon.title())
+    if not month or not day.isdigit():
+        return None
+
+    try:
+        if rest.isdigit() and len(rest) == 4:
+            return datetime(int(rest), month, int(day))
+
+        hour, minute = rest.split(':')
+        date = datetime(timenow.year, month, int(day), int(hour),
+                int(minute))
+
+        # If result is in future time then it is really last year. See
+        # ftpd-topfield bug described in compute_date_fuzzy().
+        if date > timenow:
+            date = date.replace(year=timenow.year - 1)
+
+    except ValueError:
+        # E.g. 29 Feb in a non leap year, or bad time format
+        return None
+
+    return date
+
+def compute_date_fuzzy(datestr):
     '''Determine fuzzy date from Topfield'''
 
+    from dateutil import parser, relativedelta
+
     # Fuzzy parse the date
     date = parser.parse(datestr)
 
@@ -84,7 +292,8 @@ def compute_date(datestr):
     # years dates as this year (Bug + fix has been reported to msteveb
     # in Jul 2008 who will add to next version).
     if date > timenow:
-        date = parser.parse(datestr, default=lastyear)
+        date = parser.parse(datestr, default=timenow +
+                relativedelta.relativedelta(years=-1))
 
     return date
 
@@ -113,88 +322,1150 @@ def makeurl(host, path):
     # Build ftp url
     return 'ftp://' + pathjoin(host, pathf)
 
-def play(player, url):
-    '''Sends URL to media player'''
+def play(player, url, done=None):
+    '''Sends URL to media player. Player runs in background and is
+    added to the players table. Optional done(proc) is called from a
+    background thread when the player exits.'''
 
     # Split command + arguments into a list. Also add the url
     # argument.
     cmd = os.path.expanduser(str(player)).split() + [url]
 
+    start = time.time()
     try:
-        subprocess.call(cmd)
+        proc = subprocess.Popen(cmd)
     except Exception, error:
         return str(error)
 
+    timings.since('play.spawn', start, url=url)
+    players.add(proc, url, done)
     return ''
 
+class Activity:
+    '''Count of foreground listings and file operations in progress, so
+    background work can back off while any are running. Streams and
+    downloads are not counted as the scheduler shares bandwidth with
+    those.'''
+
+    def __init__(self):
+        '''Constructor to create idle activity'''
+        self.cond = threading.Condition()
+        self.count = 0
+
+    def begin(self):
+        '''Mark start of a foreground operation'''
+        self.cond.acquire()
+        self.count += 1
+        self.cond.release()
+
+    def end(self):
+        '''Mark end of a foreground operation'''
+        self.cond.acquire()
+        self.count -= 1
+        self.cond.notifyAll()
+        self.cond.release()
+
+    def busy(self, playing=True):
+        '''Return True if any foreground operation is running, or any
+        player if playing'''
+        return self.count > 0 or (playing and bool(players.list()))
+
+    def wait(self, playing=True):
+        '''Wait until no foreground operation is running, nor any player
+        if playing'''
+        self.cond.acquire()
+        while self.busy(playing):
+            # Players are not signalled so poll for those
+            self.cond.wait(1)
+        self.cond.release()
+
+# Global foreground activity
+activity = Activity()
+
+class Timings:
+    '''Rolling samples of how long each phase of an operation takes,
+    with optional trace of each to a JSON lines file'''
+
+    def __init__(self):
+        '''Constructor to create empty timings'''
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.trace = None
+
+    def add(self, phase, secs, **detail):
+        '''Record time taken by a phase, with optional detail for trace'''
+        self.lock.acquire()
+        try:
+            if phase not in self.samples:
+                self.samples[phase] = deque(maxlen=TIMING_SAMPLES)
+            self.samples[phase].append(secs)
+
+            if self.trace:
+                detail.update(time=time.time(), phase=phase, secs=secs)
+                self.trace.write(json.dumps(detail, encoding='latin-1') +
+                        '\n')
+                self.trace.flush()
+        finally:
+            self.lock.release()
+
+    def since(self, phase, start, **detail):
+        '''Record time since start of a phase. Returns the time now.'''
+        now = time.time()
+        self.add(phase, now - start, **detail)
+        return now
+
+    def stats(self):
+        '''Return sorted list of (phase, count, p50, p95, max) secs'''
+        self.lock.acquire()
+        try:
+            samples = [(p, sorted(v)) for p, v in self.samples.items()]
+        finally:
+            self.lock.release()
+
+        return [(p, len(v), v[len(v) // 2], v[len(v) * 95 // 100], v[-1])
+                for p, v in sorted(samples)]
+
+    def reset(self):
+        '''Discard all samples'''
+        self.lock.acquire()
+        self.samples.clear()
+        self.lock.release()
+
+    def tracefile(self, file):
+        '''Start appending trace to file, or stop if None'''
+        self.lock.acquire()
+        try:
+            if self.trace:
+                self.trace.close()
+            self.trace = open(file, 'a') if file else None
+        finally:
+            self.lock.release()
+
+# Global timings
+timings = Timings()
+
+class Profiler:
+    '''On demand cProfile capture of the gui thread and any tasks
+    started while it is running'''
+
+    def __init__(self):
+        '''Constructor to create stopped profiler'''
+        self.lock = threading.Lock()
+        self.main = None
+        self.profiles = []
+
+    def start(self):
+        '''Start profiling calling thread'''
+        self.profiles = []
+        self.main = cProfile.Profile()
+        self.main.enable()
+
+    def run(self, func, *args):
+        '''Run func(*args), profiled if we are running'''
+        if not self.main:
+            return func(*args)
+
+        prof = cProfile.Profile()
+        try:
+            return prof.runcall(func, *args)
+        finally:
+            self.lock.acquire()
+            self.profiles.append(prof)
+            self.lock.release()
+
+    def stop(self, file):
+        '''Stop profiling and save combined stats to file'''
+        main = self.main
+        self.main = None
+        main.disable()
+
+        self.lock.acquire()
+        try:
+            stats = pstats.Stats(main)
+            for prof in self.profiles:
+                stats.add(prof)
+            self.profiles = []
+        finally:
+            self.lock.release()
+
+        stats.dump_stats(file)
+
+# Global profiler
+profiler = Profiler()
+
+class TokenBucket:
+    '''Rate limiter allowing bursts of up to one second of bytes'''
+
+    def __init__(self, rate):
+        '''Constructor to create full bucket for rate bytes/sec'''
+        self.rate = rate
+        self.tokens = rate
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def take(self, nbytes):
+        '''Take nbytes, returning secs to wait before using them'''
+        self.lock.acquire()
+        try:
+            now = time.time()
+            self.tokens = min(self.rate,
+                    self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= nbytes
+            return -self.tokens / float(self.rate) if self.tokens < 0 else 0
+        finally:
+            self.lock.release()
+
+class Scheduler:
+    '''Admission and rate control of ftp data transfers, by host and
+    priority class'''
+
+    def __init__(self):
+        '''Constructor to create idle scheduler'''
+        self.cond = threading.Condition()
+        self.active = {}
+        self.waiting = {}
+        self.seq = 0
+        self.buckets = {}
+        self.rates = list(RATES)
+        self.yieldrate = YIELD_RATE
+
+    def limit(self, prio):
+        '''Return max transfers per host at which prio may start'''
+        return MAX_TRANSFERS if prio <= PRIO_LIST else MAX_TRANSFERS - 1
+
+    def begin(self, host, prio):
+        '''Wait for and take a transfer slot on host'''
+        start = time.time()
+        self.cond.acquire()
+        try:
+            self.seq += 1
+            ticket = (prio, self.seq)
+            waiting = self.waiting.setdefault(host, [])
+            bisect.insort(waiting, ticket)
+            active = self.active.setdefault(host, [0] * len(PRIO_NAMES))
+
+            # Slots go to the highest priority, then oldest, waiter.
+            # Lower classes have lower limits so if the first waiter
+            # can not start then none behind it can either.
+            while waiting[0] != ticket or sum(active) >= self.limit(prio):
+                self.cond.wait()
+
+            waiting.pop(0)
+            active[prio] += 1
+
+            # Let the next waiter see if it can start too
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+        timings.since('wait.' + PRIO_NAMES[prio], start, host=host)
+
+    def end(self, host, prio):
+        '''Give back a transfer slot on host'''
+        self.cond.acquire()
+        self.active[host][prio] -= 1
+        self.cond.notifyAll()
+        self.cond.release()
+
+    def playing(self, host):
+        '''Return True if anything is playing from host'''
+        active = self.active.get(host)
+        return bool(active and active[PRIO_PLAY]) or bool(players.list())
+
+    def throttle(self, host, prio, nbytes):
+        '''Sleep as needed to keep nbytes just read within rate'''
+        rate = self.rates[prio]
+        if prio > PRIO_LIST and self.yieldrate and self.playing(host):
+            rate = min(rate, self.yieldrate) if rate else self.yieldrate
+        if not rate:
+            return
+
+        # A new bucket is started whenever the rate changes
+        key = (host, prio)
+        bucket = self.buckets.get(key)
+        if not bucket or bucket.rate != rate * 1024:
+            bucket = self.buckets[key] = TokenBucket(rate * 1024)
+
+        secs = bucket.take(nbytes)
+        if secs:
+            time.sleep(secs)
+
+# Global transfer scheduler
+scheduler = Scheduler()
+
+class FTPPool:
+    '''Pool of persistent ftp control connections, keyed by host'''
+
+    def __init__(self):
+        '''Constructor to create empty pool'''
+        self.lock = threading.Lock()
+
+        # Idle connections per host, each a [ftp, login, lasttime] list
+        self.idle = {}
+
+        # Login mode which last worked per host
+        self.login = {}
+        self.keeper = None
+
+        # Features each host reports with FEAT, and whether we use MLSD
+        # if a host supports it
+        self.features = {}
+        self.mlsd = MLSD
+
+    def connect(self, host, login):
+        '''Open a new ftp connection to host[:port]'''
+        hostname, port = (host.split(':', 1) + ['21'])[:2]
+        ftp = ftplib.FTP()
+        ok = False
+        try:
+            start = time.time()
+            ftp.connect(hostname, int(port), TIMEOUT)
+            start = timings.since('ftp.connect', start, host=host)
+            if login:
+                ftp.login()
+                timings.since('ftp.login', start, host=host)
+
+            # Ask what the server supports, once per host
+            if host not in self.features:
+                try:
+                    lines = ftp.sendcmd('FEAT').splitlines()[1:-1]
+                except (ftplib.error_perm, ftplib.error_temp,
+                        ftplib.error_reply):
+                    lines = []
+                self.features[host] = set(l.split()[0].upper()
+                        for l in lines if l.strip())
+            ok = True
+        finally:
+            if not ok:
+                ftp.close()
+        return ftp
+
+    def usemlsd(self, host):
+        '''Return True if we list dirs on host with MLSD'''
+        return self.mlsd and 'MLSD' in self.features.get(host, ())
+
+    def acquire(self, host, login):
+        '''Get a working connection to host, reusing an idle one if we can'''
+        self.lock.acquire()
+        try:
+            if not self.keeper:
+                self.keeper = threading.Thread(target=self.keepalive)
+                self.keeper.setDaemon(True)
+                self.keeper.start()
+
+            conns = self.idle.get(host, [])
+            found = [c for c in conns if c[1] == login]
+            for conn in found:
+                conns.remove(conn)
+        finally:
+            self.lock.release()
+
+        # Use most recently used connection first. Those idle for a
+        # while are checked they are still alive.
+        while found:
+            conn = found.pop()
+            if time.time() - conn[2] < KEEPALIVE:
+                break
+            try:
+                conn[0].voidcmd('NOOP')
+                break
+            except ftplib.all_errors:
+                self.close(conn)
+        else:
+            conn = [self.connect(host, login), login, 0]
+
+        # Put back any unused connections, as idle as they were
+        for c in found:
+            self.release(host, c, touch=False)
+
+        return conn
+
+    def release(self, host, conn, broken=False, touch=True):
+        '''Return a connection to the pool for reuse, as just used unless
+        not touch'''
+        if broken:
+            self.close(conn)
+            return
+
+        if touch:
+            conn[2] = time.time()
+        self.lock.acquire()
+        try:
+            conns = self.idle.setdefault(host, [])
+            conns.append(conn)
+            excess = conns[:-MAXIDLE]
+            del conns[:-MAXIDLE]
+        finally:
+            self.lock.release()
+
+        for c in excess:
+            self.close(c)
+
+    def close(self, conn):
+        '''Close a connection, ignoring any errors'''
+        try:
+            conn[0].close()
+        except Exception:
+            pass
+
+    def keepalive(self):
+        '''Thread to periodically NOOP idle connections'''
+        while True:
+            time.sleep(KEEPALIVE)
+            self.lock.acquire()
+            try:
+                idle = [(h, c) for h in self.idle for c in self.idle[h]
+                        if time.time() - c[2] >= KEEPALIVE]
+                for host, conn in idle:
+                    self.idle[host].remove(conn)
+            finally:
+                self.lock.release()
+
+            for host, conn in idle:
+                try:
+                    conn[0].voidcmd('NOOP')
+                except ftplib.all_errors:
+                    self.close(conn)
+                else:
+                    self.release(host, conn)
+
+    def call(self, host, func, *args):
+        '''Run func(ftp, *args) on a pooled connection to host'''
+        conn, result = self.open(host, func, *args)
+        self.release(host, conn)
+        return result
+
+    def open(self, host, func, *args):
+        '''As call() but returns (conn, result) with the connection still
+        held, e.g. for an open data transfer. Caller must release() it.'''
+        login = self.login.get(host, True)
+        while True:
+            try:
+                conn = self.acquire(host, login)
+            except ftplib.error_perm:
+                # We sometimes are not allowed to login, so retry once
+                # without login. Other permission errors are real.
+                if not login:
+                    raise
+                login = False
+                continue
+
+            try:
+                result = func(conn[0], *args)
+
+            except (socket.error, EOFError, ftplib.error_proto):
+                self.release(host, conn, broken=True)
+
+                # A reused connection may have been dropped by the
+                # server since we last checked it, so retry once on a
+                # fresh connection.
+                if not conn[2]:
+                    raise
+                continue
+
+            except ftplib.error_temp:
+                # Server may be closing the connection, e.g. 421
+                self.release(host, conn, broken=True)
+                raise
+
+            except:
+                self.release(host, conn)
+                raise
+
+            # Remember which login mode works for this host
+            self.login[host] = login
+            return conn, result
+
+# Global pool of ftp connections
+pool = FTPPool()
+
+def fetchiter(url, prio=PRIO_LIST):
+    '''Generate ftp directory listing lines as they arrive'''
+    p = urlparse.urlparse(url)
+    reader = FTPReader(p.netloc, p.path, listing=True, prio=prio)
+    try:
+        for line in reader.lines():
+            yield line
+    finally:
+        reader.close()
+
 def fetch(url):
     '''Fetch ftp directory listing'''
     try:
-        urlf = urllib2.urlopen(url, timeout=5)
+        dirlist = list(fetchiter(url))
     except Exception, error:
         return '', str(error)
 
     # Return directory list
-    dirlist = urlf.readlines()
-    urlf.close()
     return dirlist, ''
 
-def delete(url, login=True):
-    '''Delete file/path'''
+def batch(host, items, pipeline=False, dir=None):
+    '''Send the list of ftp commands for each item over one session,
+    from dir if given. Returns list of error for each item, '' if ok.'''
+    errors = [None] * len(items)
+
+    def run(ftp):
+        if dir:
+            ftp.cwd(dir)
+
+        # Only items not yet done, in case we are retried on a new
+        # connection
+        todo = [i for i, e in enumerate(errors) if e is None]
+        depth = PIPELINE_DEPTH if pipeline else 1
+        for start in range(0, len(todo), depth):
+            window = todo[start:start + depth]
+            if pipeline:
+                for i in window:
+                    for cmd in items[i]:
+                        ftp.putcmd(cmd)
+
+            # Read every reply, but when not pipelining do not send the
+            # rest of an item's commands after one fails
+            for i in window:
+                error = ''
+                for cmd in items[i]:
+                    try:
+                        if pipeline:
+                            ftp.getresp()
+                        elif not error:
+                            ftp.sendcmd(cmd)
+                    except (ftplib.error_perm, ftplib.error_temp,
+                            ftplib.error_reply), e:
+                        error = error or str(e)
+                errors[i] = error
+
+    activity.begin()
+    try:
+        pool.call(host, run)
+    except Exception, error:
+        error = str(error) or 'Connection lost'
+        errors = [error if e is None else e for e in errors]
+    finally:
+        activity.end()
+
+    return errors
+
+def delete(host, paths, pipeline=PIPELINE):
+    '''Delete files, returning list of error for each'''
+    paths = ['/' + p.lstrip('/') for p in paths]
+    errors = batch(host, [['DELE ' + p] for p in paths], pipeline)
+    for p in paths:
+        chunks.discard(host, p)
+    return errors
+
+def rename(host, dir, renames, pipeline=PIPELINE):
+    '''Rename files in dir given list of (path, newname), returning
+    list of error for each'''
+    errors = batch(host, [['RNFR ' + basename('/' + p), 'RNTO ' + newname]
+        for p, newname in renames], pipeline, dir)
+    for p, newname in renames:
+        chunks.discard(host, '/' + p.lstrip('/'))
+        chunks.discard(host, pathjoin(dir.rstrip('/'), newname))
+    return errors
+
+class FTPReader:
+    '''Sequential binary reader of a remote file on a pooled connection'''
+
+    def __init__(self, host, path, offset=0, listing=False,
+            prio=PRIO_DOWNLOAD):
+        '''Constructor to start RETR of path from offset, or LIST of
+        dir path if listing, once the scheduler lets prio start'''
+        self.host = host
+        self.offset = offset
+        self.prio = prio
+
+        def retr(ftp):
+            if listing:
+                ftp.cwd(path or '/')
+                ftp.voidcmd('TYPE A')
+                return ftp.transfercmd('MLSD' if pool.usemlsd(host) else
+                        'LIST')
+
+            ftp.voidcmd('TYPE I')
+            return ftp.transfercmd('RETR ' + path, offset or None)
+
+        scheduler.begin(host, prio)
+        try:
+            self.conn, self.sock = pool.open(host, retr)
+        except:
+            scheduler.end(host, prio)
+            raise
+        self.eof = False
+
+    def read(self, size):
+        '''Read up to size bytes, less only at end of file'''
+        data = []
+        left = size
+        while left > 0 and not self.eof:
+            buf = self.sock.recv(min(left, 65536))
+            if not buf:
+                self.eof = True
+            left -= len(buf)
+            data.append(buf)
+            scheduler.throttle(self.host, self.prio, len(buf))
+
+        data = ''.join(data)
+        self.offset += len(data)
+        return data
+
+    def lines(self):
+        '''Generate lines of text as they arrive'''
+        f = self.sock.makefile('rb')
+        try:
+            # Throttle as for read(), by the 64 KB
+            pending = 0
+            for line in iter(f.readline, ''):
+                pending += len(line)
+                if pending >= 65536:
+                    scheduler.throttle(self.host, self.prio, pending)
+                    pending = 0
+                yield line.rstrip('\r\n')
+        finally:
+            f.close()
+
+        self.eof = True
+
+    def close(self):
+        '''Finish or abort transfer and return connection to pool'''
+        self.sock.close()
+        scheduler.end(self.host, self.prio)
+
+        # Server replies 226 when complete, or typically 426 if we
+        # aborted the transfer early. The connection is reusable after
+        # either.
+        try:
+            self.conn[0].voidresp()
+        except (ftplib.error_temp, ftplib.error_perm, ftplib.error_reply):
+            pass
+        except ftplib.all_errors:
+            pool.release(self.host, self.conn, broken=True)
+            return
 
-    # Although we use urllib2 to fetch dir listings we can't use it to
-    # delete files. We must implement a lower level ftp interface to do
-    # that.
-    p = urlparse.urlparse(url)
-    ftp = ftplib.FTP(p.hostname, str(p.port))
+        pool.release(self.host, self.conn)
+
+def filesize(host, path):
+    '''Get size of remote file'''
+    def size(ftp):
+        ftp.voidcmd('TYPE I')
+        return ftp.size(path)
+
+    return pool.call(host, size)
+
+class ChunkCache:
+    '''LRU cache of recently read file chunks, bounded in total bytes'''
+
+    def __init__(self, maxbytes=CHUNK_CACHE):
+        '''Constructor to create empty cache'''
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.chunks = OrderedDict()
+
+    def get(self, key):
+        '''Return chunk data for key, or None'''
+        self.lock.acquire()
+        try:
+            data = self.chunks.pop(key, None)
+            if data is not None:
+                self.chunks[key] = data
+        finally:
+            self.lock.release()
+
+        return data
+
+    def put(self, key, data):
+        '''Store chunk data, evicting least recently used'''
+        self.lock.acquire()
+        try:
+            old = self.chunks.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self.chunks[key] = data
+            self.bytes += len(data)
+            while self.bytes > self.maxbytes and len(self.chunks) > 1:
+                self.bytes -= len(self.chunks.popitem(last=False)[1])
+        finally:
+            self.lock.release()
+
+    def discard(self, host, path):
+        '''Drop all chunks of a file, e.g. after it is deleted or
+        renamed so another file may take its path'''
+        self.lock.acquire()
+        try:
+            for key in [k for k in self.chunks if k[:2] == (host, path)]:
+                self.bytes -= len(self.chunks.pop(key))
+        finally:
+            self.lock.release()
+
+# Global cache of streamed file chunks
+chunks = ChunkCache()
+
+class Streamer:
+    '''Background reader of sequential chunks of a remote file into
+    the chunk cache, keeping READAHEAD chunks ahead of the consumer'''
+
+    def __init__(self, host, path, size, index):
+        '''Constructor to start reading from chunk index'''
+        self.host = host
+        self.path = path
+        self.key = (host, path, size)
+        self.nchunks = (size + CHUNK_SIZE - 1) // CHUNK_SIZE
+        self.want = index
+        self.ready = {}
+        self.error = ''
+        self.closed = False
+        self.cond = threading.Condition()
+        Task(self.run, index)
+
+    def get(self, index):
+        '''Wait for and return chunk index'''
+        self.cond.acquire()
+        try:
+            self.want = index
+            self.cond.notifyAll()
+            while index not in self.ready and not self.error:
+                self.cond.wait()
+
+            # Drop chunks we have moved past
+            for i in [i for i in self.ready if i < index]:
+                del self.ready[i]
+
+            if index not in self.ready:
+                raise IOError(self.error)
+            return self.ready[index]
+        finally:
+            self.cond.release()
+
+    def close(self):
+        '''Stop reading'''
+        self.cond.acquire()
+        self.closed = True
+        self.cond.notifyAll()
+        self.cond.release()
+
+    def run(self, task, index):
+        '''Background thread to read chunks'''
+        reader = None
+        try:
+            while index < self.nchunks:
+                self.cond.acquire()
+                try:
+                    while index >= self.want + READAHEAD and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        break
+                finally:
+                    self.cond.release()
+
+                # Skip chunks we already have cached
+                key = self.key + (index,)
+                data = chunks.get(key)
+                if data is None:
+                    offset = index * CHUNK_SIZE
+                    if not reader or reader.offset != offset:
+                        if reader:
+                            reader.close()
+                        reader = FTPReader(self.host, self.path, offset,
+                                prio=PRIO_PLAY)
+                    data = reader.read(CHUNK_SIZE)
+                    if not data:
+                        raise IOError('Unexpected end of file')
+                    chunks.put(key, data)
+
+                self.cond.acquire()
+                self.ready[index] = data
+                self.cond.notifyAll()
+                self.cond.release()
+                index += 1
+
+        except Exception, error:
+            self.cond.acquire()
+            self.error = str(error) or 'Read error'
+            self.cond.notifyAll()
+            self.cond.release()
+
+        if reader:
+            reader.close()
+
+class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Serve HTTP (range) requests for /host/path from the PVR'''
+
+    def do_HEAD(self):
+        '''Handle HEAD request'''
+        self.serve(False)
+
+    def do_GET(self):
+        '''Handle GET request'''
+        self.serve(True)
+
+    def serve(self, body):
+        '''Send headers, and optionally body, for requested range'''
+        host, path, tail = self.server.parse(self.path)
+        if tail:
+            self.tail(host, path, body)
+            return
 
-    try:
-        if login:
-            ftp.login()
-        ftp.delete(p.path)
-        ftp.quit()
+        # Size is fetched for every request as the file may have grown,
+        # or been replaced by another of the same name
+        try:
+            size = filesize(host, path)
+        except Exception, error:
+            self.send_error(404, str(error))
+            return
 
-    except ftplib.error_perm, error:
+        # Compute requested byte range
+        start, end = 0, size - 1
+        m = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if m and (m.group(1) or m.group(2)):
+            if not m.group(1):
+                start = max(size - int(m.group(2)), 0)
+            else:
+                start = int(m.group(1))
+                if m.group(2):
+                    end = min(int(m.group(2)), end)
+
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % size)
+                self.end_headers()
+                return
 
-        # Avoid infinite recurse
-        if not login:
-            return str(error)
+            self.send_response(206)
+            self.send_header('Content-Range',
+                    'bytes %d-%d/%d' % (start, end, size))
+        else:
+            self.send_response(200)
 
-        # We sometimes see an error on delete where we are not allowed
-        # to login.
-        return delete(url, login=False)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'video/MP2T')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
 
-    except Exception, error:
-        return str(error)
+        if not body:
+            return
 
-    return ''
+        # Send chunks from cache, starting a background reader on the
+        # first one we don't have
+        streamer = None
+        key = (host, path, size)
+        pos = start
+        requested = time.time()
+        try:
+            while pos <= end:
+                index = pos // CHUNK_SIZE
+                data = chunks.get(key + (index,))
+                if data is None:
+                    if not streamer:
+                        streamer = Streamer(host, path, size, index)
+                    data = streamer.get(index)
+
+                base = index * CHUNK_SIZE
+                data = data[pos - base:end + 1 - base]
+                if not data:
+                    raise IOError('Short chunk at offset %d' % pos)
+                if pos == start:
+                    timings.since('proxy.first', requested, path=path,
+                            offset=start)
+                self.wfile.write(data)
+                pos += len(data)
+
+        except (IOError, socket.error):
+            # Player closed connection, typically to seek
+            pass
+        finally:
+            if streamer:
+                streamer.close()
+
+    def tail(self, host, path, body):
+        '''Stream a growing recording from the start, following it as it
+        grows until it has stopped growing for MONITOR_DONE secs'''
+
+        # Length is unknown so body is ended by closing the connection
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/MP2T')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        if not body:
+            return
 
-def rename(oldurl, newname, login=True):
-    '''Rename file'''
+        offset = 0
+        idle = 0
+        buffered = False
+        try:
+            while idle < MONITOR_DONE:
+                size = filesize(host, path)
+
+                # Wait for enough to buffer before we first send, and
+                # then for the file to grow
+                if size <= offset or (not buffered and
+                        size < self.server.tailbuffer):
+                    time.sleep(self.server.tailpoll)
+                    idle += self.server.tailpoll
+                    continue
+
+                # Fetch only the bytes added since we last read
+                buffered = True
+                idle = 0
+                reader = FTPReader(host, path, offset, prio=PRIO_PLAY)
+                try:
+                    while offset < size:
+                        data = reader.read(min(CHUNK_SIZE, size - offset))
+                        if not data:
+                            break
+                        self.wfile.write(data)
+                        offset += len(data)
+                finally:
+                    reader.close()
+
+        except (IOError, socket.error):
+            # Player closed connection
+            pass
+        except ftplib.all_errors:
+            pass
+
+    def log_message(self, format, *args):
+        '''Suppress logging of each request'''
+        pass
+
+class Proxy(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''Local HTTP streaming proxy in front of the PVR ftp server'''
+    daemon_threads = True
+
+    # Growing recording poll time and initial buffer, as set from config
+    tailpoll = TAIL_POLL
+    tailbuffer = TAIL_BUFFER
 
-    # Although we use urllib2 to fetch dir listings we can't use it to
-    # rename files. We must implement a lower level ftp interface to do
-    # that.
-    old = urlparse.urlparse(oldurl)
-    ftp = ftplib.FTP(old.hostname, str(old.port))
+    def __init__(self):
+        '''Constructor to start server on a free localhost port'''
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                ProxyHandler)
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def url(self, host, path):
+        '''Create proxy url given host + path'''
+        return 'http://127.0.0.1:%d/%s/%s' % (self.server_address[1],
+                host, urllib.quote(path.lstrip('/')))
+
+    def tailurl(self, host, path):
+        '''Create proxy url to follow growing recording given host + path'''
+        return self.url('tail/' + host, path)
+
+    def parse(self, urlpath):
+        '''Return (host, path, tail) from proxy url path'''
+        urlpath = urllib.unquote(urlpath).lstrip('/')
+        tail = urlpath.startswith('tail/')
+        if tail:
+            urlpath = urlpath[5:]
+
+        host, path = (urlpath.split('/', 1) + [''])[:2]
+        return host, '/' + path, tail
+
+# Local streaming proxy, started when first needed
+proxy = None
+
+def getproxy():
+    '''Return local streaming proxy, starting it if necessary'''
+    global proxy
+    if not proxy:
+        proxy = Proxy()
+    return proxy
+
+class DiskCache:
+    '''Size capped local directory of downloaded recordings, with
+    least recently used files evicted first'''
+
+    def __init__(self, dir=None, maxbytes=DOWNLOAD_SIZE * 1024 * 1024):
+        '''Constructor to set cache dir + size'''
+        self.dir = dir or os.path.join(get_default_cachedir(), 'downloads')
+        self.maxbytes = maxbytes
+        self.lock = threading.Lock()
+
+    def localpath(self, host, path):
+        '''Return local file name for remote host + path'''
+        return os.path.join(self.dir, host.replace(':', '_'),
+                *path.strip('/').split('/'))
+
+    def lookup(self, host, path, size):
+        '''Return local file name if we have complete copy, else None'''
+        local = self.localpath(host, path)
+        try:
+            if os.path.getsize(local) != size:
+                return None
+
+            # Mark as recently used
+            os.utime(local, None)
+        except OSError:
+            return None
+
+        return local
+
+    def evict(self, keep=None):
+        '''Remove least recently used files until under size cap'''
+        self.lock.acquire()
+        try:
+            files = []
+            for dir, dirs, names in os.walk(self.dir):
+                for name in names:
+                    # Skip files of downloads in progress
+                    if name.endswith(('.part', '.seg', '.seg.tmp')):
+                        continue
+                    local = os.path.join(dir, name)
+                    try:
+                        st = os.stat(local)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, local))
+
+            total = sum(f[1] for f in files)
+            for mtime, size, local in sorted(files):
+                if total <= self.maxbytes:
+                    break
+                if local != keep:
+                    try:
+                        os.remove(local)
+                    except OSError:
+                        continue
+                    total -= size
+        finally:
+            self.lock.release()
+
+# Global cache of downloaded recordings
+diskcache = DiskCache()
+
+# Local files being downloaded to, so two downloads of one file do not
+# write the same segments at once
+downloading = set()
+downloadlock = threading.Lock()
+
+def download(host, path, size, local, progress=None):
+    '''Download remote file to local in parallel segments, resuming any
+    earlier partial download. Optional progress(bytes) is called from
+    background threads as data arrives. Returns error, '' if ok.'''
+    downloadlock.acquire()
+    busy = local in downloading
+    downloading.add(local)
+    downloadlock.release()
+    if busy:
+        return 'Already downloading ' + path
 
     try:
-        if login:
-            ftp.login()
-        ftp.cwd(dirname(old.path))
-        ftp.rename(basename(old.path), newname)
-        ftp.quit()
+        return fetchsegments(host, path, size, local, progress)
+    finally:
+        downloadlock.acquire()
+        downloading.discard(local)
+        downloadlock.release()
+
+def fetchsegments(host, path, size, local, progress=None):
+    '''Download remote file to local as for download(), which makes sure
+    only one download of local runs at once'''
+    part = local + '.part'
+    segfile = local + '.seg'
+
+    # Split into segments of (start, end) and read how much of each
+    # was already fetched by any earlier attempt
+    step = max((size + SEGMENTS - 1) // SEGMENTS, 1)
+    segs = [(start, min(start + step, size))
+            for start in range(0, size, step)]
+    done = [0] * len(segs)
+    if os.path.exists(part) and os.path.exists(segfile):
+        try:
+            vals = [int(x) for x in open(segfile).read().split()]
+        except (IOError, ValueError):
+            vals = []
+
+        # Start again if the saved progress is not for these segments
+        if vals[:2] == [size, len(segs)] and len(vals) == len(segs) + 2 \
+                and all(0 <= n <= e - s for n, (s, e) in
+                        zip(vals[2:], segs)):
+            done = vals[2:]
 
-    except ftplib.error_perm, error:
+    try:
+        if not os.path.isdir(os.path.dirname(local)):
+            os.makedirs(os.path.dirname(local))
+        f = open(part, 'r+b' if any(done) else 'wb')
+        f.truncate(size)
+        f.close()
+    except Exception, error:
+        return str(error)
 
-        # Avoid infinite recurse
-        if not login:
-            return str(error)
+    lock = threading.Lock()
+    errors = []
+
+    def save():
+        # Replace progress file in one step so it is never seen half
+        # written. Windows can not rename over an existing file.
+        tmp = segfile + '.tmp'
+        f = open(tmp, 'w')
+        f.write(' '.join(str(x) for x in [size, len(segs)] + done))
+        f.close()
+        if platform.system() == 'Windows' and os.path.exists(segfile):
+            os.remove(segfile)
+        os.rename(tmp, segfile)
+
+    def fetchseg(i):
+        start, end = segs[i]
+        offset = start + done[i]
+        if offset >= end:
+            return
 
-        # We sometimes see an error on rename where we are not allowed
-        # to login.
-        return rename(oldurl, newname, login=False)
+        reader = None
+        f = None
+        try:
+            f = open(part, 'r+b')
+            reader = FTPReader(host, path, offset)
+            while offset < end and not errors:
+                data = reader.read(min(CHUNK_SIZE, end - offset))
+                if not data:
+                    raise IOError('Short read at offset %d' % offset)
+                f.seek(offset)
+                f.write(data)
+                f.flush()
+                offset += len(data)
+
+                lock.acquire()
+                try:
+                    done[i] = offset - start
+                    save()
+                finally:
+                    lock.release()
+
+                if progress:
+                    progress(sum(done))
+
+        except Exception, error:
+            errors.append(str(error))
+
+        if f:
+            f.close()
+        if reader:
+            reader.close()
+
+    threads = [threading.Thread(target=fetchseg, args=(i,))
+            for i in range(len(segs))]
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        return errors[0]
+
+    # Check every segment was written to its end before making local
+    # copy available. The part file already has the full size from
+    # truncate() so can not be checked itself.
+    if any(start + n != end for n, (start, end) in zip(done, segs)):
+        return 'Downloaded size does not match %d bytes' % size
 
+    try:
+        if os.path.exists(local):
+            os.remove(local)
+        os.rename(part, local)
+        os.remove(segfile)
     except Exception, error:
         return str(error)
 
@@ -219,317 +1490,2172 @@ def namecheck(oldname, newname):
     # New file name ok
     return ''
 
-class Entries:
-    '''Class to manage each directory/file line'''
+class Task:
+    '''A cancellable background task run in its own thread'''
+
+    def __init__(self, func, *args):
+        '''Constructor to start func(task, *args) in a thread'''
+        self.cancelled = False
+        thread = threading.Thread(target=profiler.run,
+                args=(func, self) + args)
+        thread.setDaemon(True)
+        thread.start()
+
+    def cancel(self):
+        '''Flag task as superseded so its results are discarded'''
+        self.cancelled = True
+
+class ListingCache:
+    '''LRU cache of built directory entries, keyed by (host, dir)'''
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        '''Constructor to create empty cache'''
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.listings = OrderedDict()
+
+    def get(self, host, dir):
+        '''Return (entries, fresh) for host + dir, or (None, False)'''
+        self.lock.acquire()
+        try:
+            val = self.listings.pop((host, dir), None)
+            if not val:
+                return None, False
+
+            # Re-insert to mark as most recently used
+            self.listings[(host, dir)] = val
+        finally:
+            self.lock.release()
+
+        fetched, entries = val
+        return entries, time.time() - fetched < self.ttl
+
+    def put(self, host, dir, entries, fetched=None):
+        '''Store entries for host + dir, evicting least recently used'''
+        self.lock.acquire()
+        try:
+            self.listings.pop((host, dir), None)
+            self.listings[(host, dir)] = (fetched or time.time(), entries)
+            while len(self.listings) > self.size:
+                self.listings.popitem(last=False)
+        finally:
+            self.lock.release()
+
+    def update(self, host, dir, func):
+        '''Apply func to a copy of cached entries for host + dir,
+        keeping original fetch time. Returns new entries or None if
+        not cached.'''
+        self.lock.acquire()
+        try:
+            val = self.listings.get((host, dir))
+            if not val:
+                return None
+
+            fetched, entries = val
+            entries = func(list(entries))
+            self.listings[(host, dir)] = (fetched, entries)
+        finally:
+            self.lock.release()
+
+        return entries
+
+    def expire(self, host, dir):
+        '''Mark cached listing for host + dir as stale'''
+        self.lock.acquire()
+        try:
+            val = self.listings.get((host, dir))
+            if val:
+                self.listings[(host, dir)] = (0, val[1])
+        finally:
+            self.lock.release()
+
+    def remove(self, host, dir, paths):
+        '''Remove file paths from cached listing after we delete them'''
+        paths = set(paths)
+        return self.update(host, dir,
+                lambda entries: [x for x in entries if x.path not in paths])
+
+    def rename(self, host, dir, renames):
+        '''Rename file paths in cached listing after we rename them,
+        given dict of new name for each path'''
+        def ren(entries):
+            for i, x in enumerate(entries):
+                if x.path in renames:
+                    entries[i] = Entry.makefile(pathjoin(dirname(x.path),
+                        renames[x.path]), x.date, x.bytes)
+            return entries
+
+        return self.update(host, dir, ren)
+
+# Global cache of directory listings
+cache = ListingCache()
+
+class Players:
+    '''Table of running media player processes'''
+
+    def __init__(self):
+        '''Constructor to create empty table'''
+        self.lock = threading.Lock()
+        self.procs = []
+
+    def add(self, proc, url, done=None):
+        '''Add started player process to table and reap it on exit'''
+        proc.url = url
+        proc.started = datetime.now()
+        self.lock.acquire()
+        self.procs.append(proc)
+        self.lock.release()
+        Task(self.reap, proc, done)
+
+    def reap(self, task, proc, done):
+        '''Background thread to wait for player to exit'''
+        proc.wait()
+        self.lock.acquire()
+        self.procs.remove(proc)
+        self.lock.release()
+        if done:
+            done(proc)
+
+    def list(self):
+        '''Return list of running player processes'''
+        self.lock.acquire()
+        procs = list(self.procs)
+        self.lock.release()
+        return procs
+
+    def stop(self, proc):
+        '''Stop player, killing it if it does not exit promptly'''
+        try:
+            proc.terminate()
+        except OSError:
+            return
+
+        def kill():
+            if proc.poll() is None:
+                try:
+                    proc.kill()
+                except OSError:
+                    pass
+
+        timer = threading.Timer(STOP_WAIT, kill)
+        timer.setDaemon(True)
+        timer.start()
+
+# Global table of running players
+players = Players()
+
+# Programme details from a recording header
+Header = namedtuple('Header', 'channel minutes title description')
+
+def parse_header(data):
+    '''Return Header parsed from start of a TF5000 series .rec file.
+    Fields are big endian. Returns empty Header if data is too short.'''
+    if len(data) < 0x58:
+        return Header('', 0, '', '')
+
+    def text(s):
+        # Drop any DVB character table prefix, which is 0x10 and 2 bytes
+        # or else a single control byte, then trailing padding
+        if s[:1] == '\x10':
+            s = s[3:]
+        elif s[:1] and s[0] < ' ':
+            s = s[1:]
+        return s.split('\0', 1)[0].strip()
+
+    minutes = struct.unpack('>H', data[0x02:0x04])[0]
+    channel = text(data[0x1c:0x34])
+
+    # Event text is the title of given length followed by description
+    titlelen = ord(data[0x55])
+    event = data[0x57:0x57 + 273]
+    return Header(channel, minutes, text(event[:titlelen]),
+            text(event[titlelen:]))
+
+class Entry(object):
+    '''A directory or file line. Display strings are computed only when
+    a row is drawn.'''
+    __slots__ = ('path', 'dir', 'name', 'date', 'bytes', 'up', 'stamp',
+            'rate', 'header')
 
     @staticmethod
-    def build(host, basedir, lines):
-        '''Build dir + file list entries'''
-        Entries.alllist = []
-        Entries.dirlist = []
-        Entries.filelist = []
+    def makedir(dir, display, up=False, stamp=''):
+        '''Create dir entry'''
+        return Entry('', dir, display, None, 0, up, stamp)
 
-        # For each line returned in ftp dir list ..
+    @staticmethod
+    def makefile(path, date, size):
+        '''Create file entry'''
+        return Entry(path, '', None, date, size)
+
+    def __init__(self, path, dir, name, date=None, bytes=0, up=False,
+            stamp=''):
+        '''Constructor to create dir/file entry'''
+        self.path = path
+        self.dir = dir
+        self.name = name
+        self.date = date
+        self.bytes = bytes
+        self.up = up
+        self.stamp = stamp
+
+        # Growth rate in MB/s of a monitored recording in progress
+        self.rate = None
+
+        # Programme details read from recording header, once probed
+        self.header = None
+
+    @property
+    def recording(self):
+        '''True if entry is a recording in progress'''
+        return bool(self.path) and (self.bytes == 0 or self.rate is not None)
+
+    @property
+    def display(self):
+        '''Name displayed for entry'''
+        if self.path:
+            return basename('/' + self.path)[:-4]
+        return self.name
+
+    @property
+    def datestr(self):
+        '''Date displayed for entry'''
+        if self.date:
+            return self.date.strftime('%Y-%m-%d %H:%M %a')
+        return ''
+
+    @property
+    def size(self):
+        '''Size displayed for entry, in MB'''
+        if not self.path:
+            return ''
+
+        # Mark in-progress recordings, with progress if monitored
+        if self.rate is not None:
+            return 'REC %d (%.1f MB/s)' % (self.bytes / (1024 * 1024),
+                    self.rate)
+        if self.bytes == 0:
+            return 'RECORDING'
+        return str(self.bytes / (1024 * 1024))
+
+    @property
+    def channel(self):
+        '''Channel displayed for entry, once probed'''
+        return self.header.channel if self.header else ''
+
+    @property
+    def length(self):
+        '''Duration displayed for entry, once probed'''
+        if self.header and self.header.minutes:
+            return '%d:%02d' % divmod(self.header.minutes, 60)
+        return ''
+
+    @property
+    def description(self):
+        '''Programme description displayed for entry, once probed'''
+        return self.header.description if self.header else ''
+
+    def key(self):
+        '''Return key identifying this entry within a listing'''
+        return self.path or self.dir
+
+    def row(self):
+        '''Return fields which determine how this entry is displayed'''
+        return self.name, self.date, self.bytes, self.rate, self.header
+
+class Entries:
+    '''Class to manage a listing of directory/file lines'''
+
+    def __init__(self, host, basedir):
+        '''Constructor to create empty listing of basedir on host'''
+        self.host = host
+        self.basedir = basedir
+
+        # Dirs are kept first, in the order listed, then files sorted on
+        # date
+        self.alllist = []
+        self.ndirs = 0
+
+        # Secs spent waiting for, parsing and sorting lines by build()
+        self.times = [0., 0., 0.]
+
+    @property
+    def dirlist(self):
+        '''List of dir entries'''
+        return self.alllist[:self.ndirs]
+
+    @property
+    def filelist(self):
+        '''List of file entries, in date order'''
+        return self.alllist[self.ndirs:]
+
+    def build(self, lines, progress=None):
+        '''Build dir + file list entries as lines arrive, returning
+        combined list. Optional progress(entries) is called with each
+        BATCH of new entries, in the order they arrived.'''
+
+        # Long running daemons and gui sessions must see the current year
+        settime()
+
+        # For each line returned in ftp dir list .. Note time spent
+        # waiting for lines and parsing them.
+        times = self.times
+        dirs = []
+        files = []
+        batch = []
+        t0 = time.time()
         for line in lines:
-            line = line.strip()
+            t1 = time.time()
+            ent = Entries.parse(self.basedir, line)
+            times[0] += t1 - t0
+            times[1] += time.time() - t1
+            if ent:
+                if ent.path:
+                    files.append(ent)
+                else:
+                    dirs.append(ent)
+                if progress:
+                    batch.append(ent)
+                    if len(batch) >= BATCH:
+                        progress(batch)
+                        batch = []
+            t0 = time.time()
+
+        # Sort files on date once they have all arrived. The sort is
+        # stable and files usually arrive in date order so it is quick.
+        files.sort(key=lambda x:x.date)
+        self.alllist = dirs + files
+        self.ndirs = len(dirs)
+        times[2] += time.time() - t0
+
+        # Servers do not always list the parent dir with MLSD, so add it
+        # if it was not listed
+        up = dirname(self.basedir)
+        if up != '/' and not any(x.up for x in self.alllist[:self.ndirs]):
+            self.alllist.insert(0, Entry.makedir(up, '[../]', True))
+            self.ndirs += 1
+
+        return self.alllist
 
-            if line[0] == 'd':
-                # Set directory display
-                display = line[59:]
+    @staticmethod
+    def parse(basedir, line):
+        '''Parse ftp dir list line into an entry, or None to skip it'''
+        line = line.strip()
+        if not line:
+            return None
 
-                if display[0] == '.':
-                    dir = dirname(basedir)
+        # MLSD lines start with facts, LIST lines with permissions
+        if Entries.FACTS.match(line):
+            return Entries.parsefacts(basedir, line)
 
-                    # Don't allow user to go above base directory
-                    if dir == '/':
-                        continue
+        if line[0] == 'd':
+            # Set directory display
+            display = line[59:]
 
-                    display = '[../]'
-                    up = True
-                else:
-                    dir = pathjoin(basedir, display)
-                    up = False
+            if display[0] == '.':
+                dir = dirname(basedir)
 
-                    # Always display a '/' at end of directories
-                    if display[:-1] != '/':
-                        display += '/'
+                # Don't allow user to go above base directory
+                if dir == '/':
+                    return None
 
-                # Create dir list entry
-                ent = Entries('', dir, display)
-                ent.up = up
-                Entries.dirlist.append(ent)
+                display = '[../]'
+                up = True
             else:
-                # Set file display
-                sizestr, rest = line.split(None, 5)[4:6]
-                size = int(sizestr)
+                dir = pathjoin(basedir, display)
+                up = False
 
-                # Mark in-progress recordings
-                if size == 0:
-                    sizemb = 'RECORDING'
-                else:
-                    sizemb = str(size / (1024 * 1024))
+                # Always display a '/' at end of directories
+                if display[:-1] != '/':
+                    display += '/'
 
-                datestr = rest[:12]
-                filename = rest[13:]
+            # Create dir list entry. Keep the listing fields before the
+            # name so we can tell if the dir has changed.
+            return Entry.makedir(dir, display, up, line[:59])
 
-                date = compute_date(datestr)
-                datestr = date.strftime('%Y-%m-%d %H:%M %a')
-                path = pathjoin(basedir[1:], filename)
+        # Set file display
+        sizestr, rest = line.split(None, 5)[4:6]
+        size = int(sizestr)
 
-                # Create file list entry (and add date attribute for files)
-                ent = Entries(path, '', filename[:-4], datestr, sizemb)
-                ent.date = date
-                Entries.filelist.append(ent)
+        datestr = rest[:12]
+        filename = rest[13:]
 
-        # Sort the file list based on date (python 2.4+ feature)
-        Entries.filelist.sort(key=lambda x:x.date)
+        date = compute_date(datestr)
+        path = pathjoin(basedir[1:], filename)
 
-        # Create combined dir + file list for display
-        Entries.alllist = Entries.dirlist + Entries.filelist
+        # Create file list entry
+        return Entry.makefile(path, date, size)
 
-    def __init__(self, path, dir, display, datestr='', size=''):
-        '''Constructor to create dir/file entry'''
-        self.path = path
-        self.dir = dir
-        self.display = display
-        self.datestr = datestr
-        self.size = size
+    # Start of an MLSD line
+    FACTS = re.compile(r'[\w.-]+=')
 
-class AWListCtrl(wx.ListCtrl, ListCtrlAutoWidthMixin):
-    '''An Auto width mixin list control'''
-    def __init__(self, parent, style=wx.LC_REPORT):
-        wx.ListCtrl.__init__(self, parent, -1, style=style)
-        ListCtrlAutoWidthMixin.__init__(self)
-
-class MyPanel(wx.Panel):
-    def __init__(self, parent):
-        '''Constructor'''
-        wx.Panel.__init__(self, parent, -1)
-        self.parent = parent
-        self.sb = parent.sb
-
-        # Read host, setting default if necessary
-        self.cfg = wx.Config(NAME)
-        self.host = ''
-        if self.cfg.Exists('host'):
-            self.host = self.cfg.Read('host')
-        if not self.host:
-            self.host = HOST
-
-        # Read player command, setting default if necessary
-        self.player = ''
-        if self.cfg.Exists('player'):
-            self.player = self.cfg.Read('player')
-        if not self.player:
-            self.player = get_default_player()
-
-        # Set default dir to start with
-        self.dir = BASEDIR
-
-        # Master vertical box sizer
-        vbox = wx.BoxSizer(wx.VERTICAL)
-
-        # Use flex grid for host + dir stuff
-        hbox1 = wx.FlexGridSizer(3, 2, 4, 6)
-
-        # Player:
-        playlabel = wx.StaticText(self, -1, 'Media Player :')
-        self.playent = wx.TextCtrl(self, -1, self.player,
-                style=wx.TE_RICH|wx.TE_RICH2|wx.TE_PROCESS_ENTER)
-        self.playent.Bind(wx.EVT_TEXT_ENTER, self.newPlayer)
-        hbox1.Add(playlabel, 1, wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL)
-        hbox1.Add(self.playent, 1, wx.EXPAND)
-
-        # Host:
-        hostlabel = wx.StaticText(self, -1, 'Topfield FTP Host :')
-        self.hostent = wx.TextCtrl(self, -1, self.host,
-                style=wx.TE_RICH|wx.TE_RICH2|wx.TE_PROCESS_ENTER)
-        self.hostent.Bind(wx.EVT_TEXT_ENTER, self.refresh)
-        hbox1.Add(hostlabel, 1, wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL)
-        hbox1.Add(self.hostent, 1, wx.EXPAND)
-
-        # Directory:
-        dirlabel = wx.StaticText(self, -1, 'Directory :')
-        self.dirent = wx.StaticText(self, -1, self.dir)
-        hbox1.Add(dirlabel, 1, wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL)
-        hbox1.Add(self.dirent, 1, wx.EXPAND)
-
-        hbox1.AddGrowableCol(1)
-        vbox.Add(hbox1, 0, wx.ALL|wx.EXPAND, 5)
-
-        # List of files/dirs ..
-        fileslabel = wx.StaticText(self, -1, 'Recorded Files :')
-        vbox.Add(fileslabel, 0, wx.LEFT|wx.TOP, 10)
-        vbox.Add((-1, 10))
-
-        # Get standard dir and file icons
-        dir_norm = wx.ArtProvider.GetIcon(wx.ART_FOLDER,
-                wx.ART_CMN_DIALOG, (16, 16))
-        dir_up = wx.ArtProvider.GetIcon(wx.ART_GO_DIR_UP,
-                wx.ART_CMN_DIALOG, (16, 16))
-        file_norm = wx.ArtProvider.GetIcon(wx.ART_GO_FORWARD,
-                wx.ART_CMN_DIALOG, (16, 16))
-        il = wx.ImageList(16, 16)
-        self.dir_norm = il.AddIcon(dir_norm)
-        self.dir_up = il.AddIcon(dir_up)
-        self.file_norm = il.AddIcon(file_norm)
-
-        # Create a listctrl for file/dir list
-        self.list = AWListCtrl(self, style=wx.LC_REPORT|wx.SUNKEN_BORDER|
-                wx.LC_SINGLE_SEL|wx.LC_HRULES|wx.LC_VRULES)
-        self.list.AssignImageList(il, wx.IMAGE_LIST_SMALL)
-        self.list.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.activate)
-        self.list.InsertColumn(0, 'Name', width=430)
-        self.list.InsertColumn(1, 'Date/Time', width=160)
-        self.list.InsertColumn(2, 'Size (MB)', format=wx.LIST_FORMAT_RIGHT)
-
-        vbox.Add(self.list, 1, wx.LEFT|wx.RIGHT|wx.EXPAND, 10)
-        vbox.Add((-1, 15))
-
-        # Bottom buttons
-        hbox2 = wx.BoxSizer(wx.HORIZONTAL)
-
-        btnsel = wx.Button(self, -1, '&Play', size=BUTTON_SIZE)
-        btnsel.Bind(wx.EVT_BUTTON, self.activate)
-        hbox2.Add(btnsel, 0, wx.LEFT|wx.BOTTOM, 5)
-
-        btndel = wx.Button(self, -1, '&Delete', size=BUTTON_SIZE)
-        btndel.Bind(wx.EVT_BUTTON, self.delete)
-        hbox2.Add(btndel, 0, wx.LEFT|wx.BOTTOM, 5)
-
-        btnren = wx.Button(self, -1, '&Rename', size=BUTTON_SIZE)
-        btnren.Bind(wx.EVT_BUTTON, self.rename)
-        hbox2.Add(btnren, 0, wx.LEFT|wx.BOTTOM, 5)
-
-        btnref = wx.Button(self, -1, '&Refresh', size=BUTTON_SIZE)
-        btnref.Bind(wx.EVT_BUTTON, self.refresh)
-        hbox2.Add(btnref, 0, wx.LEFT|wx.BOTTOM, 5)
-
-        btnclo = wx.Button(self, wx.ID_CLOSE, size=BUTTON_SIZE)
-        btnclo.Bind(wx.EVT_BUTTON, self.parent.closeDown)
-        hbox2.Add(btnclo, 0, wx.LEFT|wx.BOTTOM, 5)
-
-        vbox.Add(hbox2, 0, wx.ALIGN_CENTER, 10)
-        vbox.Add((-1, 5))
-
-        # Now output gui
-        self.SetSizer(vbox)
-        wx.CallLater(100, self.populate)
-
-    def setHost(self):
-        '''Check if new host entered and set it'''
-        host = self.hostent.GetValue()
-        if host != self.host:
-            self.host = host
-            self.cfg.Write('host', self.host)
-            self.sb.SetStatusText('New host entered: ' + self.host)
-
-    def setPlayer(self):
-        '''Check if new player entered and set it'''
-        player = self.playent.GetValue()
-        if player != self.player:
-            self.player = player
-            self.cfg.Write('player', self.player)
-            self.sb.SetStatusText('New player entered: ' + self.player)
-
-    def newPlayer(self, e):
-        '''Called on entry of new player'''
-        self.setPlayer()
-
-    def refresh(self, e):
-        '''Refresh the display'''
-        self.populate()
-
-    def activate(self, e):
-        '''Activate an item and/or refresh the display'''
-        self.setHost()
-        self.setPlayer()
-        index = self.list.GetFirstSelected()
-        
-        # Process an entry if one was selected
-        if index >= 0:
-            ent = Entries.alllist[index]
-
-            # If this entry has a path then play it
-            if ent.path:
-
-                if ent.size == 'RECORDING':
-                    self.sb.SetStatusText('ERROR: '
-                    'Can not play a recording while still in progress.')
-                    return
+    @staticmethod
+    def parsefacts(basedir, line):
+        '''Parse MLSD "fact=value;..; name" line into an entry, or None
+        to skip it'''
+        facts, _, name = line.partition(' ')
+        fields = dict(f.partition('=')[::2] for f in facts.lower().split(';'))
+
+        type = fields.get('type', '')
+        if type == 'pdir':
+            dir = dirname(basedir)
+
+            # Don't allow user to go above base directory
+            if dir == '/':
+                return None
+            return Entry.makedir(dir, '[../]', True, facts)
+
+        # Keep the facts so we can tell if the dir has changed
+        if type == 'dir':
+            return Entry.makedir(pathjoin(basedir, name), name + '/', False,
+                    facts)
+
+        # Skip current dir, links etc
+        if type != 'file':
+            return None
+
+        # Modify time is exact, as YYYYMMDDHHMMSS[.sss] in UTC
+        m = fields.get('modify', '')
+        try:
+            date = datetime.fromtimestamp(calendar.timegm((int(m[0:4]),
+                int(m[4:6]), int(m[6:8]), int(m[8:10]), int(m[10:12]),
+                int(m[12:14]))))
+        except ValueError:
+            date = datetime.fromtimestamp(0)
+
+        return Entry.makefile(pathjoin(basedir[1:], name), date,
+                int(fields.get('size') or 0))
+
+    @staticmethod
+    def diff(old, new):
+        '''Compare two listings keyed by path. Returns lists of keys of
+        (added, removed, changed) entries.'''
+        oldmap = dict((x.key(), x) for x in old)
+        newmap = dict((x.key(), x) for x in new)
+        added = [k for k in newmap if k not in oldmap]
+        removed = [k for k in oldmap if k not in newmap]
+        changed = [k for k, x in newmap.items() if k in oldmap and
+                oldmap[k].row() != x.row()]
+        return added, removed, changed
+
+class Store:
+    '''Persistent SQLite store of last known directory listings'''
+
+    # Fields stored for each entry, after host + dir + key
+    FIELDS = ('pos', 'path', 'subdir', 'display', 'date', 'bytes',
+            'recording', 'up', 'stamp')
+
+    def __init__(self, file=None):
+        '''Constructor to set database file'''
+        self.file = file or os.path.join(get_default_cachedir(),
+                'listings.db')
+        self.lock = threading.Lock()
+        self.ready = False
+        self.disabled = False
+
+    def connect(self):
+        '''Open database, creating it if necessary. Raises sqlite3.Error
+        if it can not be. The store is only a cache so if it can not be
+        created it is disabled from then on.'''
+        if self.disabled:
+            raise sqlite3.OperationalError('Store disabled')
+
+        if not self.ready:
+            try:
+                if not os.path.isdir(os.path.dirname(self.file)):
+                    os.makedirs(os.path.dirname(self.file))
+            except EnvironmentError, error:
+                self.disabled = True
+                raise sqlite3.OperationalError(str(error))
+
+        db = sqlite3.connect(self.file, timeout=TIMEOUT)
+
+        # Names from the PVR are byte strings, so keep them as such
+        db.text_factory = str
+        if not self.ready:
+            db.execute('create table if not exists entries (host text, '
+                    'dir text, key text, %s, primary key (host, dir, key))' %
+                    ', '.join(self.FIELDS))
+            db.execute('create table if not exists listings (host text, '
+                    'dir text, fetched real, primary key (host, dir))')
+            db.execute('create table if not exists headers (host text, '
+                    'path text, bytes integer, date text, %s, '
+                    'primary key (host, path))' % ', '.join(Header._fields))
+            db.execute('create table if not exists fingerprints (host text, '
+                    'path text, bytes integer, date text, hash text, '
+                    'primary key (host, path))')
+            db.commit()
+            self.ready = True
+
+        return db
+
+    @staticmethod
+    def row(pos, x):
+        '''Return (key, fields) of entry for storing'''
+        path, subdir, display, date, size, up, stamp = Store.pack(x)
+        return x.key(), (pos, path, subdir, display, date, size,
+                int(x.recording), up, stamp)
+
+    def load(self, host, dir):
+        '''Return (entries, fetched time) of stored listing, or
+        (None, 0) if none stored'''
+        try:
+            db = self.connect()
+            try:
+                fetched = db.execute('select fetched from listings where '
+                        'host = ? and dir = ?', (host, dir)).fetchone()
+                if not fetched:
+                    return None, 0
+
+                rows = db.execute('select path, subdir, display, date, '
+                        'bytes, up, stamp from entries where host = ? and '
+                        'dir = ? order by pos', (host, dir)).fetchall()
+            finally:
+                db.close()
+        except sqlite3.Error:
+            return None, 0
+
+        return [self.unpack(r) for r in rows], fetched[0]
 
-                url = makeurl(self.host, ent.path)
-                self.sb.SetStatusText('Playing ' + url)
-                error = play(self.player, url)
+    @staticmethod
+    def pack(x):
+        '''Return (path, subdir, display, date, bytes, up, stamp) fields
+        of entry'''
+        if x.path:
+            return (x.path, '', x.display,
+                    x.date.strftime('%Y-%m-%d %H:%M:%S'), x.bytes, 0, '')
+        return '', x.dir, x.display, '', 0, int(x.up), x.stamp
 
+    @staticmethod
+    def unpack(fields):
+        '''Return entry from fields as returned by pack()'''
+        path, subdir, display, date, size, up, stamp = fields
+        if path:
+            return Entry.makefile(path, datetime.strptime(date,
+                '%Y-%m-%d %H:%M:%S'), size)
+        return Entry.makedir(subdir, display, bool(up), stamp)
+
+    def save(self, host, dir, entries, fetched=None):
+        '''Store listing, only writing rows which differ from those
+        already stored. Returns number of rows changed.'''
+        new = dict(self.row(pos, x) for pos, x in enumerate(entries))
+
+        self.lock.acquire()
+        try:
+            db = self.connect()
+            try:
+                old = dict((r[0], tuple(r[1:])) for r in db.execute(
+                    'select key, %s from entries where host = ? and '
+                    'dir = ?' % ', '.join(self.FIELDS), (host, dir)))
+
+                removed = [k for k in old if k not in new]
+                changed = [(k, v) for k, v in new.items() if old.get(k) != v]
+
+                db.executemany('delete from entries where host = ? and '
+                        'dir = ? and key = ?',
+                        [(host, dir, k) for k in removed])
+                db.executemany('insert or replace into entries values '
+                        '(?, ?, ?, %s)' % ', '.join('?' * len(self.FIELDS)),
+                        [(host, dir, k) + v for k, v in changed])
+                db.execute('insert or replace into listings values '
+                        '(?, ?, ?)', (host, dir, fetched or time.time()))
+                db.commit()
+            finally:
+                db.close()
+        except sqlite3.Error:
+            return 0
+        finally:
+            self.lock.release()
+
+        return len(removed) + len(changed)
+
+    def loadheader(self, host, path, bytes, date):
+        '''Return stored header of recording, or None if none stored for
+        this size + date of it'''
+        try:
+            db = self.connect()
+            try:
+                row = db.execute('select %s from headers where host = ? and '
+                        'path = ? and bytes = ? and date = ?' %
+                        ', '.join(Header._fields), (host, path, bytes,
+                            date.strftime('%Y-%m-%d %H:%M:%S'))).fetchone()
+            finally:
+                db.close()
+        except sqlite3.Error:
+            return None
+
+        return Header(*row) if row else None
+
+    def saveheader(self, host, path, bytes, date, header):
+        '''Store header of recording'''
+        self.lock.acquire()
+        try:
+            db = self.connect()
+            try:
+                db.execute('insert or replace into headers values '
+                        '(?, ?, ?, ?, %s)' % ', '.join('?' * len(header)),
+                        (host, path, bytes,
+                            date.strftime('%Y-%m-%d %H:%M:%S')) + header)
+                db.commit()
+            finally:
+                db.close()
+        except sqlite3.Error:
+            pass
+        finally:
+            self.lock.release()
+
+    def loadfingerprint(self, host, path, bytes, date):
+        '''Return stored fingerprint of recording, or None if none
+        stored for this size + date of it'''
+        try:
+            db = self.connect()
+            try:
+                row = db.execute('select hash from fingerprints where '
+                        'host = ? and path = ? and bytes = ? and date = ?',
+                        (host, path, bytes,
+                            date.strftime('%Y-%m-%d %H:%M:%S'))).fetchone()
+            finally:
+                db.close()
+        except sqlite3.Error:
+            return None
+
+        return row[0] if row else None
+
+    def savefingerprint(self, host, path, bytes, date, hash):
+        '''Store fingerprint of recording'''
+        self.lock.acquire()
+        try:
+            db = self.connect()
+            try:
+                db.execute('insert or replace into fingerprints values '
+                        '(?, ?, ?, ?, ?)', (host, path, bytes,
+                            date.strftime('%Y-%m-%d %H:%M:%S'), hash))
+                db.commit()
+            finally:
+                db.close()
+        except sqlite3.Error:
+            pass
+        finally:
+            self.lock.release()
+
+# Global store of listings
+store = Store()
+
+class Indexer:
+    '''Index of every recording in the tree under a base dir on a host'''
+
+    def __init__(self, host, basedir=BASEDIR):
+        '''Constructor to create empty index'''
+        self.host = host
+        self.basedir = basedir
+        self.lock = threading.Lock()
+
+        # Index of dir -> (stamp, file entries, [(subdir, stamp), ..])
+        self.dirs = {}
+
+    def crawl(self, progress=None, task=None):
+        '''Crawl tree with concurrent listings, reusing the previous
+        index for any dir without subdirs or recordings in progress whose
+        listing stamp in its parent dir has not changed. Optional
+        progress(done, total) is called from background threads. Returns
+        list of errors.'''
+        queue = Queue.Queue()
+        olddirs = self.dirs
+        dirs = {}
+        errors = []
+        counts = [0, 1]
+
+        # Always relist the base dir
+        queue.put((self.basedir, None))
+
+        def worker():
+            while True:
+                item = queue.get()
+                if not item:
+                    return
+                try:
+                    if not (task and task.cancelled):
+                        index(*item)
+                except Exception, error:
+                    errors.append('%s: %s' % (item[0], error))
+                queue.task_done()
+
+        def index(dir, stamp):
+            # A dir's stamp only changes when its own entries do, so
+            # dirs with subdirs are always relisted to get their stamps.
+            # A recording growing or finishing does not change it either.
+            old = olddirs.get(dir)
+            if stamp and old and old[0] == stamp and not old[2] and \
+                    not any(x.recording for x in old[1]):
+                val = old
+            else:
+                alllist, error = listing(self.host, dir)
                 if error:
-                    self.sb.SetStatusText('Play error: ' + error)
+                    # Keep any previous index of this dir
+                    errors.append('%s: %s' % (dir, error))
+                    if not old:
+                        return
+                    val = old
                 else:
-                    self.sb.SetStatusText('Played ' + url)
+                    cache.put(self.host, dir, alllist)
+                    val = (stamp, [x for x in alllist if x.path],
+                            [(x.dir, x.stamp) for x in alllist
+                                if not x.path and not x.up])
+
+            self.lock.acquire()
+            dirs[dir] = val
+            counts[0] += 1
+            counts[1] += len(val[2])
+            done, total = counts
+            self.lock.release()
+
+            for sub in val[2]:
+                queue.put(sub)
+
+            if progress:
+                progress(done, total)
+
+        threads = []
+        for i in range(INDEX_WORKERS):
+            t = threading.Thread(target=worker)
+            t.setDaemon(True)
+            t.start()
+            threads.append(t)
+
+        queue.join()
+
+        # Stop workers
+        for t in threads:
+            queue.put(None)
+        for t in threads:
+            t.join()
+
+        if not (task and task.cancelled):
+            self.dirs = dirs
+
+        return errors
+
+    def recordings(self):
+        '''Return list of all indexed file entries'''
+        return [x for val in self.dirs.values() for x in val[1]]
+
+    def find(self, text):
+        '''Return indexed file entries matching text, sorted by date'''
+        text = text.lower()
+        found = [x for x in self.recordings() if text in x.path.lower()]
+        found.sort(key=lambda x:x.date)
+        return found
+
+    def remove(self, paths):
+        '''Remove file paths from index after we delete them'''
+        paths = set(paths)
+        self.lock.acquire()
+        for dir, (stamp, files, subdirs) in self.dirs.items():
+            if any(x.path in paths for x in files):
+                self.dirs[dir] = (stamp, [x for x in files
+                    if x.path not in paths], subdirs)
+        self.lock.release()
+
+class Prefetcher:
+    '''Low priority background lister of the directories most likely
+    to be visited next, into the listing cache'''
 
+    def __init__(self):
+        '''Constructor to create idle prefetcher'''
+        self.queue = Queue.Queue()
+        self.generation = 0
+        self.workers = []
+
+    def prefetch(self, host, entries):
+        '''Queue subdirs + parent dir of a listing, superseding any
+        earlier prefetches not yet started'''
+        while len(self.workers) < PREFETCH_WORKERS:
+            self.workers.append(Task(self.worker))
+
+        # Dirs come first in a listing, and the parent first of those
+        # as ftpd-topfield lists ".." first.
+        self.generation += 1
+        dirs = [x.dir for x in entries if not x.path]
+        for dir in dirs[:PREFETCH_MAX]:
+            self.queue.put((self.generation, host, dir))
+
+    def worker(self, task):
+        '''Background thread to list queued dirs'''
+        while True:
+            generation, host, dir = self.queue.get()
+
+            # Skip if superseded, or already cached
+            if generation != self.generation:
+                continue
+            entries, fresh = cache.get(host, dir)
+            if fresh:
+                continue
+
+            activity.wait()
+            if generation != self.generation:
+                continue
+
+            def lines():
+                # Abandon listing as soon as foreground work starts
+                for line in fetchiter(makeurl(host, dir), PRIO_PROBE):
+                    if activity.busy():
+                        raise IOError('Prefetch interrupted')
+                    yield line
+
+            # The daemon, if any, lists the PVR for us
+            if daemon:
+                entries, error = daemon.list(host, dir)
+                if error:
+                    continue
+            else:
+                try:
+                    entries = Entries(host, dir).build(lines())
+                except Exception:
+                    continue
+
+            cache.put(host, dir, entries)
+            store.save(host, dir, entries)
+
+# Global prefetcher
+prefetcher = Prefetcher()
+
+class Monitor:
+    '''Tracks recordings in progress by polling just those files with
+    SIZE + MDTM, instead of relisting their directories'''
+
+    def __init__(self, update):
+        '''Constructor. update(host, dir, entry) is called from a
+        background thread with each changed recording entry.'''
+        self.update = update
+        self.cond = threading.Condition()
+
+        # Tracked recordings, keyed by (host, path). Each is a dict of
+        # dir, entry, last size + mdtm, time last polled + changed, and
+        # poll interval (plus the interval to resume at after errors).
+        self.files = {}
+        self.thread = None
+
+    def watch(self, host, dir, entries):
+        '''Start tracking any recordings in progress in a listing'''
+        self.cond.acquire()
+        try:
+            for x in entries:
+                if x.recording and (host, x.path) not in self.files:
+                    now = time.time()
+                    self.files[(host, x.path)] = dict(dir=dir, entry=x,
+                            bytes=None, mdtm=None, polled=0, changed=now,
+                            interval=MONITOR_MIN)
+
+            if self.files and not self.thread:
+                self.thread = Task(self.run)
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def run(self, task):
+        '''Background thread to poll recordings as they fall due'''
+        while True:
+            self.cond.acquire()
+            try:
+                now = time.time()
+                due = [(k, f) for k, f in self.files.items()
+                        if now >= f['polled'] + f['interval']]
+                if not due:
+                    wait = min([f['polled'] + f['interval'] - now
+                        for f in self.files.values()] or [MONITOR_MAX])
+                    self.cond.wait(wait)
+                    continue
+            finally:
+                self.cond.release()
+
+            for key, f in due:
+                self.poll(key, f)
+
+    def poll(self, key, f):
+        '''Poll one recording and report any change'''
+        host, path = key
+
+        def stat(ftp):
+            ftp.voidcmd('TYPE I')
+            size = ftp.size('/' + path)
+            try:
+                mdtm = ftp.sendcmd('MDTM /' + path)
+            except ftplib.error_perm:
+                mdtm = None
+            return size, mdtm
+
+        now = time.time()
+        try:
+            size, mdtm = pool.call(host, stat)
+        except ftplib.error_perm:
+            # File has gone, e.g. deleted or renamed
+            size, mdtm = None, None
+        except Exception:
+            # Server unreachable or busy so back off, remembering the
+            # interval to resume at once a poll succeeds again
+            f.setdefault('resume', f['interval'])
+            f['polled'] = now
+            f['interval'] = min(f['interval'] * 2, MONITOR_MAX)
+            return
+
+        f['interval'] = f.pop('resume', f['interval'])
+        old = f['entry']
+        finished = False
+        if size is None:
+            entry = None
+            finished = True
+        elif f['bytes'] is not None and (size, mdtm) == (f['bytes'],
+                f['mdtm']):
+            # No change so back off, or finish if unchanged long enough
+            f['polled'] = now
+            f['interval'] = min(f['interval'] * 2, MONITOR_MAX)
+            if now - f['changed'] < MONITOR_DONE:
+                return
+            entry = Entry.makefile(old.path, old.date, size)
+            finished = True
+        else:
+            # Changed so poll again soon
+            entry = Entry.makefile(old.path, old.date, size)
+            entry.rate = 0.
+            if f['bytes'] is not None:
+                entry.rate = (size - f['bytes']) / (now - f['changed']) / \
+                        (1024 * 1024)
+            f.update(entry=entry, bytes=size, mdtm=mdtm, polled=now,
+                    changed=now, interval=MONITOR_MIN)
+
+        # Stop tracking if finished or gone
+        if finished:
+            self.cond.acquire()
+            self.files.pop(key, None)
+            self.cond.release()
+
+        if entry:
+            self.update(host, f['dir'], entry)
+
+class Prober:
+    '''Low priority background reader of the programme details at the
+    start of recordings, aborting each transfer after the header'''
+
+    def __init__(self):
+        '''Constructor to create idle prober'''
+        self.queue = Queue.Queue()
+        self.generation = 0
+        self.workers = []
+        self.lock = threading.Lock()
+
+        # Headers read, keyed by (host, path, size, date)
+        self.headers = OrderedDict()
+
+    @staticmethod
+    def key(host, x):
+        '''Return key identifying a recording header'''
+        return host, x.path, x.bytes, x.date
+
+    def get(self, key):
+        '''Return any header already read for key'''
+        self.lock.acquire()
+        try:
+            return self.headers.get(key)
+        finally:
+            self.lock.release()
+
+    def add(self, key, header):
+        '''Remember a header, discarding the oldest if necessary'''
+        self.lock.acquire()
+        try:
+            self.headers.pop(key, None)
+            self.headers[key] = header
+            while len(self.headers) > PROBE_CACHE:
+                self.headers.popitem(last=False)
+        finally:
+            self.lock.release()
+
+    def probe(self, host, entries, update):
+        '''Fill in known headers of a listing and queue the rest,
+        superseding any earlier probes not yet started. update(key, header)
+        is called from a background thread as each is read.'''
+        while len(self.workers) < PROBE_WORKERS:
+            self.workers.append(Task(self.worker))
+
+        self.generation += 1
+        for x in entries:
+            if not x.path or x.recording or x.header:
+                continue
+            x.header = self.get(self.key(host, x))
+            if not x.header:
+                self.queue.put((self.generation, self.key(host, x), update))
+
+    def worker(self, task):
+        '''Background thread to read queued headers'''
+        while True:
+            generation, key, update = self.queue.get()
+            if generation != self.generation:
+                continue
+
+            host, path, size, date = key
+            header = self.get(key) or store.loadheader(*key)
+            if not header:
+                # The scheduler slows probes while anything is playing,
+                # so only wait for foreground listings
+                activity.wait(playing=False)
+                if generation != self.generation:
+                    continue
+
+                # Read just the header then abort the transfer
+                try:
+                    reader = FTPReader(host, '/' + path, prio=PRIO_PROBE)
+                    try:
+                        data = reader.read(PROBE_SIZE)
+                    finally:
+                        reader.close()
+                except Exception:
+                    continue
+
+                header = parse_header(data)
+                store.saveheader(host, path, size, date, header)
+
+            self.add(key, header)
+            update(key, header)
+
+# Global recording header prober
+prober = Prober()
+
+def fingerprint(host, x):
+    '''Return hash of sampled ranges of recording entry, reusing any
+    stored for this size + date of it'''
+    hash = store.loadfingerprint(host, x.path, x.bytes, x.date)
+    if hash:
+        return hash
+
+    # Small files are read whole, else ranges spread from start to end
+    if x.bytes <= DEDUP_SAMPLES * DEDUP_SAMPLE_SIZE:
+        ranges = [(0, x.bytes)]
+    else:
+        step = (x.bytes - DEDUP_SAMPLE_SIZE) // (DEDUP_SAMPLES - 1)
+        ranges = [(i * step, DEDUP_SAMPLE_SIZE)
+                for i in range(DEDUP_SAMPLES)]
+
+    # Sample reads are background probes, which give way to foreground
+    # listings and are slowed by the scheduler while anything plays
+    activity.wait(playing=False)
+    start = time.time()
+    md5 = hashlib.md5(str(x.bytes))
+    for offset, size in ranges:
+        # Read just this range then abort the transfer
+        reader = FTPReader(host, '/' + x.path, offset, prio=PRIO_PROBE)
+        try:
+            data = reader.read(size)
+        finally:
+            reader.close()
+        if len(data) != size:
+            raise IOError('Short read at offset %d' % offset)
+        md5.update(data)
+
+    hash = md5.hexdigest()
+    timings.since('dedup.sample', start, path=x.path)
+    store.savefingerprint(host, x.path, x.bytes, x.date, hash)
+    return hash
+
+def duplicates(host, entries, progress=None, task=None):
+    '''Find recordings with the same content, comparing fingerprints
+    of only those of the same size. Optional progress(done, total) is
+    called from background threads. Returns (list of sets of entries,
+    each oldest first, list of errors).'''
+    bysize = {}
+    for x in entries:
+        if x.path and not x.recording:
+            bysize.setdefault(x.bytes, []).append(x)
+
+    queue = Queue.Queue()
+    for group in bysize.values():
+        if len(group) > 1:
+            for x in group:
+                queue.put(x)
+
+    lock = threading.Lock()
+    hashes = {}
+    errors = []
+    counts = [0, queue.qsize()]
+
+    def worker():
+        while not (task and task.cancelled):
+            try:
+                x = queue.get_nowait()
+            except Queue.Empty:
                 return
+            try:
+                hash = fingerprint(host, x)
+            except Exception, error:
+                hash = None
+                error = '/%s: %s' % (x.path, str(error) or 'Read error')
+
+            lock.acquire()
+            if hash:
+                hashes[x.path] = (x.bytes, hash)
+            else:
+                errors.append(error)
+            counts[0] += 1
+            done, total = counts
+            lock.release()
+
+            if progress:
+                progress(done, total)
+
+    threads = []
+    for i in range(DEDUP_WORKERS):
+        t = threading.Thread(target=worker)
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        t.join()
+
+    sets = {}
+    for x in entries:
+        if x.path in hashes:
+            sets.setdefault(hashes[x.path], []).append(x)
+
+    # Largest first, as those free the most space
+    sets = [sorted(v, key=lambda x:x.date) for v in sets.values()
+            if len(v) > 1]
+    sets.sort(key=lambda v:(-v[0].bytes, v[0].path))
+    return sets, errors
+
+def jsondumps(msg):
+    '''Return message as a line of JSON. Names from the PVR are byte
+    strings so are passed as latin-1.'''
+    return json.dumps(msg, encoding='latin-1', separators=(',', ':')) + '\n'
+
+def jsonloads(line):
+    '''Return message from a line of JSON, with strings back as byte
+    strings'''
+    def bytestr(val):
+        if isinstance(val, unicode):
+            return val.encode('latin-1')
+        if isinstance(val, list):
+            return [bytestr(x) for x in val]
+        if isinstance(val, dict):
+            return dict((bytestr(k), bytestr(v)) for k, v in val.items())
+        return val
+
+    return bytestr(json.loads(line))
+
+def address(addr, host='127.0.0.1'):
+    '''Return (host, port) from "host[:port]" string'''
+    h, _, port = addr.partition(':')
+    return h or host, int(port or DAEMON_PORT)
+
+class DaemonHandler(SocketServer.StreamRequestHandler):
+    '''Session of a client of the listing cache daemon. Each request
+    and reply is one line of JSON. A client watching a dir is also sent
+    a "changed" event line whenever its listing changes.'''
+
+    def handle(self):
+        '''Read and action requests until client disconnects'''
+        self.lock = threading.Lock()
+        try:
+            for line in iter(self.rfile.readline, ''):
+                try:
+                    req = jsonloads(line)
+                    op = req['op']
+                    key = req['host'], req['dir']
+                except (ValueError, KeyError, TypeError):
+                    self.send(dict(error='Bad request'))
+                    continue
+
+                if op == 'list':
+                    entries, error = self.server.list(*key,
+                            refresh=req.get('refresh'))
+                    self.send(dict(error=error, entries=[Store.pack(x)
+                        for x in entries or []]))
+                elif op == 'watch':
+                    self.server.watch(self, key)
+                    self.send(dict(error=''))
+                else:
+                    self.send(dict(error='Unknown op %s' % op))
+        except socket.error:
+            pass
+        finally:
+            self.server.watch(self, None)
+
+    def send(self, msg):
+        '''Send message line to client'''
+        self.lock.acquire()
+        try:
+            self.wfile.write(jsondumps(msg))
+            self.wfile.flush()
+        finally:
+            self.lock.release()
+
+class Daemon(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    '''Listing cache daemon, sharing one set of PVR listings among any
+    number of launchers'''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr):
+        '''Constructor to listen on given (host, port)'''
+        SocketServer.TCPServer.__init__(self, addr, DaemonHandler)
+        self.lock = threading.Lock()
+
+        # Lock + last fetch time of each listing, so concurrent requests
+        # for one dir share a single fetch
+        self.fetching = {}
+
+        # Dir watched by each client session
+        self.watching = {}
+        Task(self.poll)
+
+    def list(self, host, dir, refresh=False):
+        '''Return (entries, error) for host + dir, from cache if fresh
+        unless refresh'''
+        start = time.time()
+        key = (host, dir)
+        entries, fresh = cache.get(host, dir)
+        if fresh and not refresh:
+            return entries, ''
+
+        self.lock.acquire()
+        val = self.fetching.setdefault(key, [threading.Lock(), 0])
+        self.lock.release()
+
+        val[0].acquire()
+        try:
+            # Use result of any fetch which completed while we waited
+            entries, fresh = cache.get(host, dir)
+            if val[1] >= start or (fresh and not refresh):
+                return entries, ''
+
+            lines, error = fetch(makeurl(host, dir))
+            if error:
+                return entries, error
+
+            old = entries
+            entries = Entries(host, dir).build(lines)
+            cache.put(host, dir, entries)
+            val[1] = time.time()
+        finally:
+            val[0].release()
+
+        if old is not None and any(Entries.diff(old, entries)):
+            self.notify(key)
+        return entries, ''
+
+    def watch(self, session, key):
+        '''Set dir watched by client session, or None to stop'''
+        self.lock.acquire()
+        if key:
+            self.watching[session] = key
+        else:
+            self.watching.pop(session, None)
+        self.lock.release()
+
+    def notify(self, key):
+        '''Tell clients watching a dir that it has changed'''
+        self.lock.acquire()
+        sessions = [s for s, k in self.watching.items() if k == key]
+        self.lock.release()
+
+        for session in sessions:
+            try:
+                session.send(dict(event='changed', host=key[0], dir=key[1]))
+            except socket.error:
+                pass
+
+    def poll(self, task):
+        '''Background thread to relist watched dirs'''
+        while True:
+            time.sleep(DAEMON_POLL)
+            self.lock.acquire()
+            keys = set(self.watching.values())
+            self.lock.release()
+
+            for key in keys:
+                self.list(*key, refresh=True)
+
+class DaemonClient:
+    '''Client of a listing cache daemon'''
+
+    def __init__(self, addr):
+        '''Constructor given daemon "host[:port]"'''
+        self.addr = address(addr)
+        self.lock = threading.Lock()
+        self.conn = None
+        self.watcher = None
+
+    def connect(self):
+        '''Return new (socket, file) connection to daemon'''
+        sock = socket.create_connection(self.addr, DAEMON_TIMEOUT)
+        return sock, sock.makefile('rb')
+
+    def request(self, msg):
+        '''Send request and return reply, reconnecting once if our
+        connection has been dropped'''
+        self.lock.acquire()
+        try:
+            for retry in (bool(self.conn), False):
+                try:
+                    if not self.conn:
+                        self.conn = self.connect()
+                    self.conn[0].sendall(jsondumps(msg))
+                    line = self.conn[1].readline()
+                    if not line:
+                        raise EOFError('Daemon closed connection')
+                    return jsonloads(line)
+                except (socket.error, EOFError), error:
+                    self.conn = None
+                    if not retry:
+                        return dict(error='Daemon error: %s' % error)
+        finally:
+            self.lock.release()
+
+    def list(self, host, dir, refresh=False):
+        '''Return (entries, error) for host + dir from daemon'''
+        reply = self.request(dict(op='list', host=host, dir=dir,
+            refresh=refresh))
+        if reply['error']:
+            return None, reply['error']
+        return [Store.unpack(f) for f in reply['entries']], ''
+
+    def watch(self, host, dir, changed):
+        '''Watch host + dir for changes, instead of any dir watched
+        before. changed(host, dir) is called from a background thread.'''
+        try:
+            if not self.watcher:
+                self.watcher = self.connect()
+                Task(self.read, self.watcher, changed)
+            self.watcher[0].sendall(jsondumps(dict(op='watch', host=host,
+                dir=dir)))
+        except socket.error:
+            self.watcher = None
+
+    def read(self, task, conn, changed):
+        '''Background thread to read events from daemon'''
+        conn[0].settimeout(None)
+        try:
+            for line in iter(conn[1].readline, ''):
+                msg = jsonloads(line)
+                if msg.get('event') == 'changed':
+                    changed(msg['host'], msg['dir'])
+        except (socket.error, ValueError):
+            pass
+
+        if self.watcher is conn:
+            self.watcher = None
+
+# Client of shared listing cache daemon, if one is configured
+daemon = None
+
+def listing(host, dir, refresh=False):
+    '''Return (entries, error) for host + dir, from the listing cache
+    daemon if configured, else from the PVR'''
+    if daemon:
+        return daemon.list(host, dir, refresh)
+
+    lines, error = fetch(makeurl(host, dir))
+    if error:
+        return None, error
+    return Entries(host, dir).build(lines), ''
+
+def cli(args):
+    '''Command line interface, without the gui. Returns exit code.'''
+    opt = argparse.ArgumentParser(prog=NAME,
+            description='Run without arguments to start the gui.')
+    opt.add_argument('-H', '--host', default=HOST,
+            help='ftpd-topfield host[:port], default %(default)s')
+    opt.add_argument('-d', '--dir', default=BASEDIR,
+            help='dir for relative paths, default %(default)s')
+    opt.add_argument('-j', '--json', action='store_true',
+            help='output results as JSON')
+    opt.add_argument('-D', '--daemon',
+            help='get listings from listing cache daemon at host[:port]')
+    cmds = opt.add_subparsers(dest='cmd', title='commands')
+
+    cmd = cmds.add_parser('list', help='list a dir')
+    cmd.add_argument('path', nargs='?', default='',
+            help='dir to list, default --dir')
+    cmd = cmds.add_parser('find', help='find recordings in all dirs')
+    cmd.add_argument('text', help='text to match in path')
+    cmd = cmds.add_parser('dups', help='find recordings stored more than '
+            'once in all dirs')
+    cmd = cmds.add_parser('play', help='play a recording')
+    cmd.add_argument('-p', '--player', default=get_default_player(),
+            help='media player, default %(default)s')
+    cmd.add_argument('path', help='recording to play')
+    cmd = cmds.add_parser('delete', help='delete recordings')
+    cmd.add_argument('-y', '--yes', action='store_true',
+            help='do not ask to confirm')
+    cmd.add_argument('paths', nargs='+', help='recordings to delete')
+    cmd = cmds.add_parser('rename', help='rename a recording')
+    cmd.add_argument('path', help='recording to rename')
+    cmd.add_argument('newname', help='new file name')
+    cmd = cmds.add_parser('download', help='download a recording')
+    cmd.add_argument('path', help='recording to download')
+    cmd.add_argument('local', nargs='?',
+            help='local file, default is into the download cache')
+    cmd = cmds.add_parser('serve', help='run listing cache daemon')
+    cmd.add_argument('-l', '--listen', default='127.0.0.1:%d' % DAEMON_PORT,
+            help='[host]:port to listen on, default %(default)s. Use '
+            '0.0.0.0 to serve the LAN.')
+    args = opt.parse_args(args)
+
+    global daemon
+    if args.daemon:
+        daemon = DaemonClient(args.daemon)
+
+    def abspath(path):
+        return path if path.startswith('/') else pathjoin(
+                args.dir.rstrip('/'), path)
+
+    def entry(x):
+        return dict(path='/' + x.path if x.path else '', dir=x.dir,
+                name=x.display, bytes=x.bytes, recording=x.recording,
+                date=x.date.isoformat() if x.date else None)
+
+    def output(entries):
+        if args.json:
+            print json.dumps([entry(x) for x in entries], indent=1)
+            return
+        for x in entries:
+            if x.path:
+                print '%s %8s  %s' % (x.datestr, x.size, '/' + x.path)
+            elif not x.up:
+                print '%-29s %s/' % ('', x.dir)
+
+    def results(items, errors):
+        if args.json:
+            print json.dumps([dict(path=i, error=e)
+                for i, e in zip(items, errors)], indent=1)
+        else:
+            for i, e in zip(items, errors):
+                if e:
+                    print >>sys.stderr, '%s: %s' % (i, e)
+        return 1 if any(errors) else 0
+
+    host = args.host
+    if args.cmd == 'list':
+        dir = abspath(args.path) if args.path else args.dir
+        entries, error = listing(host, dir)
+        if error:
+            return results([dir], [error])
+        output(entries)
+
+    elif args.cmd == 'find':
+        indexer = Indexer(host, args.dir)
+        errors = indexer.crawl()
+        output(indexer.find(args.text))
+        for e in errors:
+            print >>sys.stderr, e
+
+    elif args.cmd == 'dups':
+        indexer = Indexer(host, args.dir)
+        errors = indexer.crawl()
+        sets, errs = duplicates(host, indexer.recordings())
+        if args.json:
+            print json.dumps([[entry(x) for x in dups] for dups in sets],
+                    indent=1)
+        else:
+            for i, dups in enumerate(sets):
+                if i:
+                    print
+                output(dups)
+        for e in errors + errs:
+            print >>sys.stderr, e
+
+    elif args.cmd == 'play':
+        path = abspath(args.path)
+        try:
+            size = filesize(host, path)
+        except Exception, error:
+            return results([path], [str(error)])
+        url = diskcache.lookup(host, path, size) or makeurl(host, path)
+        return results([url], [play(args.player, url)])
+
+    elif args.cmd == 'delete':
+        paths = [abspath(p) for p in args.paths]
+        if not args.yes:
+            if not sys.stdin.isatty():
+                return results(paths, ['Use --yes to delete'] * len(paths))
+            print '\n'.join(paths)
+            if raw_input('Delete these %d files? [y/N] ' %
+                    len(paths)).lower() not in ('y', 'yes'):
+                return 1
+        return results(paths, delete(host, paths))
+
+    elif args.cmd == 'rename':
+        path = abspath(args.path)
+        newname = args.newname
+
+        # Append file ext for user convenience, as in the gui
+        if not newname.lower().endswith('.rec') and '.' not in newname:
+            newname += '.rec'
+
+        error = namecheck(basename(path), newname)
+        if not error:
+            error = rename(host, dirname(path), [(path, newname)])[0]
+        return results([path], [error])
+
+    elif args.cmd == 'download':
+        path = abspath(args.path)
+        try:
+            size = filesize(host, path)
+        except Exception, error:
+            return results([path], [str(error)])
+        local = args.local or diskcache.localpath(host, path)
+        try:
+            error = download(host, path, size, local)
+            if not error and not args.local:
+                diskcache.evict(keep=local)
+        except EnvironmentError, error:
+            error = str(error)
+        if not args.json and not error:
+            print local
+        return results([path], [error])
+
+    elif args.cmd == 'serve':
+        server = Daemon(address(args.listen, ''))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    return 0
+
+# Any arguments run the command line interface instead of the gui
+if __name__ == '__main__' and len(sys.argv) > 1:
+    sys.exit(cli(sys.argv[1:]))
+
+# The gui is only defined when run as a program, so the launcher can be
+# imported without wxPython, e.g. by the benchmarks
+if __name__ == '__main__':
+    import wx
+    from wx.lib.mixins.listctrl import ListCtrlAutoWidthMixin
+
+    class AWListCtrl(wx.ListCtrl, ListCtrlAutoWidthMixin):
+        '''An Auto width mixin list control. If created with LC_VIRTUAL
+        style then rows are drawn directly from a list of entries.'''
+        def __init__(self, parent, style=wx.LC_REPORT):
+            wx.ListCtrl.__init__(self, parent, -1, style=style)
+            ListCtrlAutoWidthMixin.__init__(self)
+
+            # Virtual mode entries, entry attribute shown in each column,
+            # and icons. Icons are indexes into image list for (file, up
+            # dir, dir).
+            self.entries = []
+            self.index = {}
+            self.columns = ('display', 'datestr', 'size')
+            self.icons = (-1, -1, -1)
+
+            # Highlight any current recording in progress and distinguish
+            # files by colour
+            self.attr_rec = wx.ListItemAttr()
+            self.attr_rec.SetTextColour(wx.RED)
+            self.attr_file = wx.ListItemAttr()
+            self.attr_file.SetTextColour(wx.BLUE)
+
+        def setEntries(self, entries):
+            '''Set virtual list entries, redrawing only rows which have changed
+            and keeping the selection and scroll position'''
+            old = self.entries
+            self.entries = entries
+            added, removed, changed = Entries.diff(old, entries)
+            index = self.index = dict((x.key(), i) for i, x in
+                    enumerate(entries))
+
+            # Note selected and top rows before we change anything
+            selected = []
+            i = self.GetFirstSelected()
+            while 0 <= i < len(old):
+                selected.append(i)
+                i = self.GetNextSelected(i)
+
+            top = self.GetTopItem()
+            topkey = old[top].key() if 0 <= top < len(old) else None
+
+            # Find first row where an entry was inserted or removed. All rows
+            # after that have moved so must be redrawn.
+            first = 0
+            for x, y in zip(old, entries):
+                if x.key() != y.key():
+                    break
+                first += 1
+
+            if len(old) != len(entries):
+                self.SetItemCount(len(entries))
+            if first < len(entries) and (added or removed or first < len(old)):
+                self.RefreshItems(first, len(entries) - 1)
+
+            for key in changed:
+                if index[key] < first:
+                    self.RefreshItem(index[key])
+
+            # Reselect same entries at their new rows
+            newsel = [index[old[i].key()] for i in selected
+                    if old[i].key() in index]
+            for i in selected:
+                if i not in newsel and i < len(entries):
+                    self.Select(i, False)
+            for i in newsel:
+                self.Select(i)
+
+            # Keep the same entry at the top of the view, or go to top if it
+            # has gone (e.g. a different directory)
+            newtop = index.get(topkey, 0)
+            if newtop != top and entries:
+                self.EnsureVisible(min(newtop + self.GetCountPerPage() - 1,
+                    len(entries) - 1))
+                self.EnsureVisible(newtop)
+
+        def addEntries(self, entries):
+            '''Append virtual list entries, drawing only the new rows'''
+            first = len(self.entries)
+            self.entries.extend(entries)
+            for i, x in enumerate(entries, first):
+                self.index[x.key()] = i
+
+            self.SetItemCount(len(self.entries))
+            self.RefreshItems(first, len(self.entries) - 1)
+
+        def OnGetItemText(self, item, col):
+            '''Virtual list callback for row text'''
+            return getattr(self.entries[item], self.columns[col])
+
+        def OnGetItemImage(self, item):
+            '''Virtual list callback for row icon'''
+            x = self.entries[item]
+            if x.path:
+                return self.icons[0]
+            if x.up:
+                return self.icons[1]
+            return self.icons[2]
+
+        def OnGetItemAttr(self, item):
+            '''Virtual list callback for row colour'''
+            x = self.entries[item]
+            if x.recording:
+                return self.attr_rec
+            if x.path:
+                return self.attr_file
+            return None
+
+    class MyPanel(wx.Panel):
+        def __init__(self, parent):
+            '''Constructor'''
+            wx.Panel.__init__(self, parent, -1)
+            self.parent = parent
+            self.sb = parent.sb
+
+            # Read host, setting default if necessary
+            self.cfg = wx.Config(NAME)
+            self.host = ''
+            if self.cfg.Exists('host'):
+                self.host = self.cfg.Read('host')
+            if not self.host:
+                self.host = HOST
+
+            # Read player command, setting default if necessary
+            self.player = ''
+            if self.cfg.Exists('player'):
+                self.player = self.cfg.Read('player')
+            if not self.player:
+                self.player = get_default_player()
+
+            # Read whether to stream via local proxy
+            self.useproxy = False
+            if self.cfg.Exists('proxy'):
+                self.useproxy = self.cfg.ReadBool('proxy')
+
+            # Read listing cache time to live
+            if self.cfg.Exists('cachettl'):
+                cache.ttl = self.cfg.ReadInt('cachettl')
+
+            # Read download cache size
+            if self.cfg.Exists('downloadsize'):
+                diskcache.maxbytes = self.cfg.ReadInt('downloadsize') * \
+                        1024 * 1024
+
+            # Read any shared listing cache daemon to use
+            global daemon
+            if self.cfg.Exists('daemon') and self.cfg.Read('daemon'):
+                daemon = DaemonClient(self.cfg.Read('daemon'))
+
+            # Read any file to trace timings to
+            if self.cfg.Exists('trace') and self.cfg.Read('trace'):
+                timings.tracefile(os.path.expanduser(self.cfg.Read('trace')))
+
+            # Read whether to use MLSD listings
+            if self.cfg.Exists('mlsd'):
+                pool.mlsd = self.cfg.ReadBool('mlsd')
+
+            # Read whether batch commands are pipelined
+            self.pipeline = PIPELINE
+            if self.cfg.Exists('pipeline'):
+                self.pipeline = self.cfg.ReadBool('pipeline')
+
+            # Read how recordings in progress are followed
+            if self.cfg.Exists('tailpoll'):
+                Proxy.tailpoll = self.cfg.ReadInt('tailpoll')
+            if self.cfg.Exists('tailbuffer'):
+                Proxy.tailbuffer = self.cfg.ReadInt('tailbuffer') * 1024
+
+            # Get transfer rate limits, in KB/s
+            if self.cfg.Exists('downloadrate'):
+                scheduler.rates[PRIO_DOWNLOAD] = self.cfg.ReadInt(
+                        'downloadrate')
+            if self.cfg.Exists('proberate'):
+                scheduler.rates[PRIO_PROBE] = self.cfg.ReadInt('proberate')
+            if self.cfg.Exists('yieldrate'):
+                scheduler.yieldrate = self.cfg.ReadInt('yieldrate')
+
+            # Set default dir to start with
+            self.dir = BASEDIR
+
+            # Library index of all recordings on host, built on demand
+            self.indexer = None
+
+            # Monitor of displayed recordings in progress
+            self.monitor = Monitor(lambda host, dir, entry:
+                    wx.CallAfter(self.recordingUpdated, host, dir, entry))
+
+            # Entries currently displayed, and any background population
+            # in progress
+            self.alllist = []
+            self.task = None
+            self.started = 0
+
+            # Master vertical box sizer
+            vbox = wx.BoxSizer(wx.VERTICAL)
+
+            # Use flex grid for host + dir stuff
+            hbox1 = wx.FlexGridSizer(4, 2, 4, 6)
+
+            # Player:
+            playlabel = wx.StaticText(self, -1, 'Media Player :')
+            self.playent = wx.TextCtrl(self, -1, self.player,
+                    style=wx.TE_RICH|wx.TE_RICH2|wx.TE_PROCESS_ENTER)
+            self.playent.Bind(wx.EVT_TEXT_ENTER, self.newPlayer)
+            hbox1.Add(playlabel, 1, wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL)
+            hbox1.Add(self.playent, 1, wx.EXPAND)
+
+            # Host:
+            hostlabel = wx.StaticText(self, -1, 'Topfield FTP Host :')
+            self.hostent = wx.TextCtrl(self, -1, self.host,
+                    style=wx.TE_RICH|wx.TE_RICH2|wx.TE_PROCESS_ENTER)
+            self.hostent.Bind(wx.EVT_TEXT_ENTER, self.refresh)
+            hbox1.Add(hostlabel, 1, wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL)
+            hbox1.Add(self.hostent, 1, wx.EXPAND)
+
+            # Directory:
+            dirlabel = wx.StaticText(self, -1, 'Directory :')
+            self.dirent = wx.StaticText(self, -1, self.dir)
+            hbox1.Add(dirlabel, 1, wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL)
+            hbox1.Add(self.dirent, 1, wx.EXPAND)
+
+            # Streaming:
+            proxylabel = wx.StaticText(self, -1, 'Streaming :')
+            self.proxyent = wx.CheckBox(self, -1,
+                    'Stream via local proxy for faster seeking')
+            self.proxyent.SetValue(self.useproxy)
+            self.proxyent.Bind(wx.EVT_CHECKBOX, self.newProxy)
+            hbox1.Add(proxylabel, 1, wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL)
+            hbox1.Add(self.proxyent, 1, wx.EXPAND)
+
+            hbox1.AddGrowableCol(1)
+            vbox.Add(hbox1, 0, wx.ALL|wx.EXPAND, 5)
+
+            # List of files/dirs ..
+            fileslabel = wx.StaticText(self, -1, 'Recorded Files :')
+            vbox.Add(fileslabel, 0, wx.LEFT|wx.TOP, 10)
+            vbox.Add((-1, 10))
+
+            # Get standard dir and file icons
+            dir_norm = wx.ArtProvider.GetIcon(wx.ART_FOLDER,
+                    wx.ART_CMN_DIALOG, (16, 16))
+            dir_up = wx.ArtProvider.GetIcon(wx.ART_GO_DIR_UP,
+                    wx.ART_CMN_DIALOG, (16, 16))
+            file_norm = wx.ArtProvider.GetIcon(wx.ART_GO_FORWARD,
+                    wx.ART_CMN_DIALOG, (16, 16))
+            il = wx.ImageList(16, 16)
+            self.dir_norm = il.AddIcon(dir_norm)
+            self.dir_up = il.AddIcon(dir_up)
+            self.file_norm = il.AddIcon(file_norm)
+
+            # Create a listctrl for file/dir list
+            self.list = AWListCtrl(self, style=wx.LC_REPORT|wx.LC_VIRTUAL|
+                    wx.SUNKEN_BORDER|wx.LC_HRULES|wx.LC_VRULES)
+            self.list.AssignImageList(il, wx.IMAGE_LIST_SMALL)
+            self.list.icons = (self.file_norm, self.dir_up, self.dir_norm)
+            self.list.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.activate)
+            self.list.columns = ('display', 'datestr', 'size', 'channel',
+                    'length', 'description')
+            self.list.InsertColumn(0, 'Name', width=430)
+            self.list.InsertColumn(1, 'Date/Time', width=160)
+            self.list.InsertColumn(2, 'Size (MB)', width=80,
+                    format=wx.LIST_FORMAT_RIGHT)
+            self.list.InsertColumn(3, 'Channel', width=120)
+            self.list.InsertColumn(4, 'Length', width=60,
+                    format=wx.LIST_FORMAT_RIGHT)
+            self.list.InsertColumn(5, 'Description')
+
+            vbox.Add(self.list, 1, wx.LEFT|wx.RIGHT|wx.EXPAND, 10)
+            vbox.Add((-1, 10))
+
+            # List of players currently streaming ..
+            playslabel = wx.StaticText(self, -1, 'Playing :')
+            vbox.Add(playslabel, 0, wx.LEFT, 10)
+            vbox.Add((-1, 5))
+
+            self.plays = AWListCtrl(self, style=wx.LC_REPORT|wx.SUNKEN_BORDER|
+                    wx.LC_SINGLE_SEL|wx.LC_HRULES|wx.LC_VRULES)
+            self.plays.SetMinSize((-1, 80))
+            self.plays.InsertColumn(0, 'Started', width=80)
+            self.plays.InsertColumn(1, 'PID', width=70,
+                    format=wx.LIST_FORMAT_RIGHT)
+            self.plays.InsertColumn(2, 'URL')
+            self.playlist = []
+
+            vbox.Add(self.plays, 0, wx.LEFT|wx.RIGHT|wx.EXPAND, 10)
+            vbox.Add((-1, 15))
+
+            # Bottom buttons
+            hbox2 = wx.BoxSizer(wx.HORIZONTAL)
+
+            btnsel = wx.Button(self, -1, '&Play', size=BUTTON_SIZE)
+            btnsel.Bind(wx.EVT_BUTTON, self.activate)
+            hbox2.Add(btnsel, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btndown = wx.Button(self, -1, 'Do&wnload', size=BUTTON_SIZE)
+            btndown.Bind(wx.EVT_BUTTON, self.download)
+            hbox2.Add(btndown, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btndel = wx.Button(self, -1, '&Delete', size=BUTTON_SIZE)
+            btndel.Bind(wx.EVT_BUTTON, self.delete)
+            hbox2.Add(btndel, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btnren = wx.Button(self, -1, '&Rename', size=BUTTON_SIZE)
+            btnren.Bind(wx.EVT_BUTTON, self.rename)
+            hbox2.Add(btnren, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btnstop = wx.Button(self, -1, '&Stop', size=BUTTON_SIZE)
+            btnstop.Bind(wx.EVT_BUTTON, self.stop)
+            hbox2.Add(btnstop, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btnref = wx.Button(self, -1, '&Refresh', size=BUTTON_SIZE)
+            btnref.Bind(wx.EVT_BUTTON, self.refresh)
+            hbox2.Add(btnref, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btnclo = wx.Button(self, wx.ID_CLOSE, size=BUTTON_SIZE)
+            btnclo.Bind(wx.EVT_BUTTON, self.parent.closeDown)
+            hbox2.Add(btnclo, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            vbox.Add(hbox2, 0, wx.ALIGN_CENTER, 10)
+            vbox.Add((-1, 5))
+
+            # Now output gui. Any stored listing is shown straight away.
+            self.SetSizer(vbox)
+            self.populate()
 
-            # Else, set new directory and repopulate
-            self.dir = ent.dir
+        def setHost(self):
+            '''Check if new host entered and set it'''
+            host = self.hostent.GetValue()
+            if host != self.host:
+                self.host = host
+                self.cfg.Write('host', self.host)
+                self.sb.SetStatusText('New host entered: ' + self.host)
+
+        def getIndexer(self):
+            '''Return library index for current host'''
+            self.setHost()
+            if not self.indexer or self.indexer.host != self.host:
+                self.indexer = Indexer(self.host)
+            return self.indexer
+
+        def goto(self, path):
+            '''Navigate to directory holding given file path'''
+            self.dir = dirname('/' + path)
             self.dirent.SetLabel(self.dir)
+            self.populate()
+
+        def setPlayer(self):
+            '''Check if new player entered and set it'''
+            player = self.playent.GetValue()
+            if player != self.player:
+                self.player = player
+                self.cfg.Write('player', self.player)
+                self.sb.SetStatusText('New player entered: ' + self.player)
+
+        def newPlayer(self, e):
+            '''Called on entry of new player'''
+            self.setPlayer()
+
+        def newProxy(self, e):
+            '''Called on change of proxy setting'''
+            self.useproxy = self.proxyent.GetValue()
+            self.cfg.WriteBool('proxy', self.useproxy)
+
+        def refresh(self, e):
+            '''Refresh the display'''
+            self.populate(revalidate=True)
+
+        def activate(self, e):
+            '''Activate an item and/or refresh the display'''
+            self.setHost()
+            self.setPlayer()
+            index = self.list.GetFirstSelected()
+            
+            # Process an entry if one was selected
+            if index >= 0:
+                ent = self.alllist[index]
+
+                # If this entry has a path then play it
+                if ent.path:
+
+                    # Play any local downloaded copy in preference. A
+                    # recording in progress is followed as it grows.
+                    url = diskcache.lookup(self.host, '/' + ent.path,
+                            ent.bytes)
+                    if ent.recording:
+                        url = getproxy().tailurl(self.host, ent.path)
+                    elif not url:
+                        if self.useproxy:
+                            url = getproxy().url(self.host, ent.path)
+                        else:
+                            url = makeurl(self.host, ent.path)
+
+                    error = play(self.player, url,
+                            lambda proc: wx.CallAfter(self.played, proc))
+
+                    if error:
+                        self.sb.SetStatusText('Play error: ' + error)
+                    else:
+                        self.sb.SetStatusText('Playing ' + url)
+                        self.showPlayers()
+
+                    return
 
-        self.populate()
+                # Else, set new directory and repopulate
+                self.dir = ent.dir
+                self.dirent.SetLabel(self.dir)
 
-    def delete(self, e):
-        '''Delete an item'''
-        self.setHost()
-        index = self.list.GetFirstSelected()
-        
-        if index < 0:
             self.populate()
-            return
 
-        # Something was selected so delete it
-        ent = Entries.alllist[index]
+        def played(self, proc):
+            '''Called in gui thread when a player has exited'''
+            self.sb.SetStatusText('Played ' + proc.url)
+            self.showPlayers()
+
+        def showPlayers(self):
+            '''Update list of running players'''
+            self.playlist = players.list()
+            self.plays.DeleteAllItems()
+            for proc in self.playlist:
+                ind = self.plays.InsertStringItem(sys.maxint,
+                        proc.started.strftime('%H:%M:%S'))
+                self.plays.SetStringItem(ind, 1, str(proc.pid))
+                self.plays.SetStringItem(ind, 2, proc.url)
+
+        def stop(self, e):
+            '''Stop selected player, or the only one running'''
+            index = self.plays.GetFirstSelected()
+            if index < 0 and len(self.playlist) == 1:
+                index = 0
+
+            if index < 0:
+                self.sb.SetStatusText('Select a player to stop')
+                return
+
+            proc = self.playlist[index]
+            self.sb.SetStatusText('Stopping ' + proc.url)
+            players.stop(proc)
 
-        # If this entry has a path then delete it
-        if ent.path:
+        def download(self, e):
+            '''Download an item to local cache'''
+            self.setHost()
+            index = self.list.GetFirstSelected()
 
-            # Put up a confirm prompt
-            dlg = wx.MessageDialog(None,
-            'Are you sure to delete\n%s:/%s?' % (self.host, ent.path),
-            'Confirm Delete', wx.YES_NO|wx.NO_DEFAULT|wx.ICON_QUESTION|
-            wx.STAY_ON_TOP)
+            if index < 0:
+                self.sb.SetStatusText('Select a file to download')
+                return
+
+            ent = self.alllist[index]
+
+            if not ent.path:
+                self.sb.SetStatusText('Not allowed to download directory')
+                return
+
+            if ent.recording:
+                self.sb.SetStatusText('ERROR: '
+                'Can not download a recording while still in progress.')
+                return
+
+            path = '/' + ent.path
+            if diskcache.lookup(self.host, path, ent.bytes):
+                self.sb.SetStatusText('Already downloaded ' + ent.path)
+                return
 
-            if dlg.ShowModal() != wx.ID_YES:
+            self.sb.SetStatusText('Downloading ' + ent.path)
+            Task(self.downloadTask, self.host, path, ent.bytes)
+
+        def downloadTask(self, task, host, path, size):
+            '''Background thread to download an item'''
+            local = diskcache.localpath(host, path)
+            last = [0]
+
+            def progress(done):
+                # Limit gui updates to each 1%
+                if done - last[0] >= size // 100:
+                    last[0] = done
+                    wx.CallAfter(self.sb.SetStatusText, 'Downloading %s %d%%' %
+                            (path, done * 100 // size))
+
+            try:
+                error = download(host, path, size, local, progress)
+                if not error:
+                    diskcache.evict(keep=local)
+            except EnvironmentError, error:
+                error = str(error)
+            wx.CallAfter(self.downloaded, path, error)
+
+        def downloaded(self, path, error):
+            '''Called in gui thread when a download has completed'''
+            if error:
+                self.sb.SetStatusText('Download error: ' + error)
+            else:
+                self.sb.SetStatusText('Downloaded ' + path)
+
+        def selected(self):
+            '''Return list of selected entries'''
+            entries = []
+            index = self.list.GetFirstSelected()
+            while 0 <= index < len(self.alllist):
+                entries.append(self.alllist[index])
+                index = self.list.GetNextSelected(index)
+            return entries
+
+        def confirm(self, message, title):
+            '''Put up a confirm prompt, returning True if user agrees'''
+            dlg = wx.MessageDialog(None, message, title, wx.YES_NO|
+                    wx.NO_DEFAULT|wx.ICON_QUESTION|wx.STAY_ON_TOP)
+            ok = dlg.ShowModal() == wx.ID_YES
+            dlg.Destroy()
+            if not ok:
                 self.sb.SetStatusText('')
-                dlg.Destroy()
+            return ok
+
+        @staticmethod
+        def summary(names, limit=10):
+            '''Return lines listing names, abbreviated if there are many'''
+            lines = names[:limit]
+            if len(names) > limit:
+                lines.append('.. and %d more' % (len(names) - limit))
+            return '\n'.join(lines)
+
+        def report(self, verb, names, errors):
+            '''Show result of a batch operation on names'''
+            failed = ['%s: %s' % (n, e) for n, e in zip(names, errors) if e]
+            if not failed:
+                if len(names) == 1:
+                    self.sb.SetStatusText('%s %s' % (verb, names[0]))
+                else:
+                    self.sb.SetStatusText('%s %d files' % (verb, len(names)))
                 return
 
+            self.sb.SetStatusText('%s %d of %d files, %d failed' % (verb,
+                len(names) - len(failed), len(names), len(failed)))
+            dlg = wx.MessageDialog(None, self.summary(failed), 'Errors',
+                    wx.OK|wx.ICON_ERROR)
+            dlg.ShowModal()
             dlg.Destroy()
-            url = makeurl(self.host, ent.path)
-            self.sb.SetStatusText('Deleting ' + url)
 
-            error = delete(url)
-            if error:
-                self.sb.SetStatusText('Delete error: ' + error)
+        def delete(self, e):
+            '''Delete selected items'''
+            self.setHost()
+            entries = self.selected()
+
+            if not entries:
+                self.populate()
+                return
+
+            # Only files can be deleted
+            paths = [x.path for x in entries if x.path]
+            if not paths:
+                self.sb.SetStatusText('Not allowed to delete directory')
+                return
+
+            if len(paths) == 1:
+                message = 'Are you sure to delete\n%s:/%s?' % (self.host,
+                        paths[0])
             else:
+                message = 'Are you sure to delete these %d files from %s:%s?' \
+                        '\n\n%s' % (len(paths), self.host, self.dir,
+                        self.summary([basename('/' + p) for p in paths]))
+
+            if not self.confirm(message, 'Confirm Delete'):
+                return
+
+            self.sb.SetStatusText('Deleting %d file[s] from %s' % (len(paths),
+                self.host))
+            Task(self.deleteTask, self.host, self.dir, paths)
+
+        def deleteTask(self, task, host, dir, paths):
+            '''Background thread to delete items over one session'''
+            start = time.time()
+            errors = delete(host, paths, self.pipeline)
+            timings.since('delete', start, count=len(paths))
+            done = [p for p, e in zip(paths, errors) if not e]
+            if done:
+                self.uncache(host, dir, done)
+            wx.CallAfter(self.deleted, host, dir, paths, errors)
+
+        @staticmethod
+        def uncache(host, dir, paths):
+            '''Remove deleted file paths from cached and stored listing of
+            dir. Called from background threads.'''
+            entries = cache.remove(host, dir, paths)
+            if entries is not None:
+                store.save(host, dir, entries)
+
+            # Have any daemon relist so other launchers see the change
+            if daemon:
+                daemon.list(host, dir, True)
+
+        def deleted(self, host, dir, paths, errors):
+            '''Called in gui thread when a delete has completed'''
+            self.updated(host, dir)
+            self.report('Deleted', [basename('/' + p) for p in paths], errors)
+
+        def rename(self, e):
+            '''Rename selected items'''
+            self.setHost()
+            entries = self.selected()
+
+            if not entries:
                 self.populate()
-                self.sb.SetStatusText('Deleted ' + url)
-        else:
-            self.sb.SetStatusText('Not allowed to delete directory')
-
-    def rename(self, e):
-        '''Rename an item'''
-        self.setHost()
-        index = self.list.GetFirstSelected()
-        
-        if index < 0:
-            self.populate()
-            return
+                return
 
-        # Something was selected so rename it
-        ent = Entries.alllist[index]
+            # Only files can be renamed
+            paths = [x.path for x in entries if x.path]
+            if not paths:
+                self.sb.SetStatusText('Not allowed to rename directory')
+                return
 
-        # If this entry has a path then rename it
-        if ent.path:
+            if len(paths) == 1:
+                renames = self.renameOne(paths[0])
+            else:
+                renames = self.renameMany(paths)
+
+            if not renames:
+                return
+
+            self.sb.SetStatusText('Renaming %d file[s] on %s' % (len(renames),
+                self.host))
+            Task(self.renameTask, self.host, self.dir, renames)
 
-            oldname = re.sub('.rec$', '', basename(ent.path), re.I)
+        def renameOne(self, path):
+            '''Prompt for new name of one file. Returns [(path, newname)]
+            or None.'''
+            oldname = re.sub('.rec$', '', basename('/' + path), re.I)
 
             # Put up a prompt
             dlg = wx.TextEntryDialog(None, 'Rename "' + oldname + '" to:',
@@ -539,7 +3665,7 @@ class MyPanel(wx.Panel):
             if dlg.ShowModal() != wx.ID_OK:
                 self.sb.SetStatusText('')
                 dlg.Destroy()
-                return
+                return None
 
             newname = dlg.GetValue()
             dlg.Destroy()
@@ -550,132 +3676,783 @@ class MyPanel(wx.Panel):
 
             if oldname == newname:
                 self.sb.SetStatusText('No name change')
-                return
-
-            error = namecheck(oldname, newname)
+                return None
 
-            if not error:
-                oldurl = makeurl(self.host, ent.path)
-                self.sb.SetStatusText('Renaming ' + oldurl)
-                error = rename(oldurl, newname)
+            error = namecheck(oldname, newname) or \
+                    self.conflicts([(path, newname)]).get(path, '')
 
             if error:
                 self.sb.SetStatusText('Rename error: ' + error)
-            else:
+                return None
+
+            return [(path, newname)]
+
+        def renameMany(self, paths):
+            '''Prompt for text to replace in the names of several files.
+            Returns [(path, newname), ..] or None.'''
+            values = []
+            for prompt in ('Replace text in %d file names:' % len(paths),
+                    'Replace with:'):
+                dlg = wx.TextEntryDialog(None, prompt, 'Rename?')
+                ok = dlg.ShowModal() == wx.ID_OK
+                values.append(dlg.GetValue())
+                dlg.Destroy()
+                if not ok:
+                    self.sb.SetStatusText('')
+                    return None
+
+            old, new = values
+            renames = []
+            for path in paths:
+                oldname = basename('/' + path)
+                newname = oldname.replace(old, new)
+                if newname == oldname:
+                    continue
+
+                error = namecheck(oldname, newname)
+                if error:
+                    self.sb.SetStatusText('Rename error: %s: %s' % (oldname,
+                        error))
+                    return None
+
+                renames.append((path, newname))
+
+            if not renames:
+                self.sb.SetStatusText('No name change')
+                return None
+
+            conflicts = self.conflicts(renames)
+            if conflicts:
+                self.sb.SetStatusText('Rename error: %d name conflict[s]' %
+                        len(conflicts))
+                dlg = wx.MessageDialog(None, self.summary(['%s -> %s: %s' %
+                    (basename('/' + p), n, conflicts[p]) for p, n in renames
+                    if p in conflicts]), 'Rename Conflicts',
+                    wx.OK|wx.ICON_ERROR)
+                dlg.ShowModal()
+                dlg.Destroy()
+                return None
+
+            message = 'Are you sure to rename these %d files?\n\n%s' % (
+                    len(renames), self.summary(['%s -> %s' % (
+                        basename('/' + p), n) for p, n in renames]))
+            if not self.confirm(message, 'Confirm Rename'):
+                return None
+
+            return renames
+
+        def conflicts(self, renames):
+            '''Return dict of error for each (path, newname) which would
+            overwrite another file, as RNTO may do so without asking'''
+            names = set(basename('/' + x.path) for x in self.alllist
+                    if x.path)
+            counts = {}
+            for p, newname in renames:
+                counts[newname] = counts.get(newname, 0) + 1
+
+            conflicts = {}
+            for p, newname in renames:
+                if newname in names:
+                    conflicts[p] = 'File already exists'
+                elif counts[newname] > 1:
+                    conflicts[p] = 'Same new name as another file'
+            return conflicts
+
+        def renameTask(self, task, host, dir, renames):
+            '''Background thread to rename items over one session'''
+            start = time.time()
+            errors = rename(host, dir, renames, self.pipeline)
+            timings.since('rename', start, count=len(renames))
+            done = dict(r for r, e in zip(renames, errors) if not e)
+            if done:
+                entries = cache.rename(host, dir, done)
+                if entries is not None:
+                    store.save(host, dir, entries)
+
+                # Have any daemon relist so other launchers see the change
+                if daemon:
+                    daemon.list(host, dir, True)
+            wx.CallAfter(self.renamed, host, dir, renames, errors)
+
+        def renamed(self, host, dir, renames, errors):
+            '''Called in gui thread when a rename has completed'''
+            self.updated(host, dir)
+            self.report('Renamed', [n for p, n in renames], errors)
+
+        def updated(self, host, dir):
+            '''Redisplay directory after we have changed its cached listing'''
+            if (host, dir) != (self.host, self.dir):
+                return
+
+            entries, fresh = cache.get(host, dir)
+            if entries is None:
                 self.populate()
-                self.sb.SetStatusText('Renamed ' + newname)
-        else:
-            self.sb.SetStatusText('Not allowed to rename directory')
+            else:
+                self.show(entries)
+
+        def show(self, entries):
+            '''Display given entries in the file list'''
+            start = time.time()
+            self.alllist = entries
+            prober.probe(self.host, entries, lambda key, header:
+                    wx.CallAfter(self.headerRead, key, header))
+            self.list.setEntries(entries)
+            self.list.resizeLastColumn(40)
+            self.monitor.watch(self.host, self.dir, entries)
+            timings.since('render', start, count=len(entries))
+
+        def headerRead(self, key, header):
+            '''Called in gui thread with header read from a recording'''
+            host, path = key[:2]
+            i = self.list.index.get(path)
+            if host != self.host or i is None:
+                return
 
-    def populate(self):
-        '''Populate the file list data given host + dir'''
-        self.Disable()
-        self.setHost()
-        self.setPlayer()
-        url = makeurl(self.host, self.dir)
-        self.sb.SetStatusText('Populating from ' + url)
-        self.list.DeleteAllItems()
+            x = self.alllist[i]
+            if Prober.key(host, x) == key:
+                x.header = header
+                self.list.RefreshItem(i)
+
+        def recordingUpdated(self, host, dir, entry):
+            '''Called in gui thread with changed recording in progress'''
+            def replace(entries):
+                return [entry if x.path == entry.path else x for x in entries]
+
+            cache.update(host, dir, replace)
+            if (host, dir) == (self.host, self.dir):
+                self.show(replace(self.alllist))
+
+        def populate(self, revalidate=False):
+            '''Populate the file list data given host + dir'''
+            self.setHost()
+            self.setPlayer()
+            url = makeurl(self.host, self.dir)
+
+            # Supersede any fetch still in progress
+            if self.task:
+                self.task.cancel()
+                self.task = None
+
+            # Show any cached listing immediately, else any stored from a
+            # previous run. Only refetch it if it is stale or the user asked
+            # for a refresh.
+            entries, fresh = cache.get(self.host, self.dir)
+            if entries is None:
+                entries, fetched = store.load(self.host, self.dir)
+                if entries is not None:
+                    cache.put(self.host, self.dir, entries, fetched)
+                    entries, fresh = cache.get(self.host, self.dir)
+
+            # Rows fetched progressively are appended to this new list
+            self.show(entries or [])
+
+            # Have any daemon tell us when this dir changes
+            if daemon:
+                daemon.watch(self.host, self.dir, lambda host, dir:
+                        wx.CallAfter(self.changed, host, dir))
+
+            if fresh and not revalidate:
+                self.sb.SetStatusText('')
+                prefetcher.prefetch(self.host, entries)
+                return
 
-        # Fetch dir listing from ftp server
-        dirlist, error = fetch(url)
+            self.sb.SetStatusText('Populating from ' + url)
+
+            # Fetch in background. If nothing is displayed yet then rows
+            # are added progressively as they arrive, else the new listing
+            # is applied to the displayed one when complete.
+            self.started = time.time()
+            self.task = Task(self.populateTask, url, self.host, self.dir,
+                    not entries, revalidate)
+
+        def populateTask(self, task, url, host, dir, progressive,
+                revalidate=False):
+            '''Background thread to fetch + build the file list'''
+            count = [0]
+
+            # Get listing from any shared daemon, which only relists the PVR
+            # if its copy is stale or we asked for a refresh
+            if daemon:
+                start = time.time()
+                alllist, error = daemon.list(host, dir, revalidate)
+                timings.since('list.daemon', start, dir=dir)
+                if task.cancelled:
+                    return
+                if error:
+                    wx.CallAfter(self.populated, task, error)
+                    return
 
-        if error:
-            self.sb.SetStatusText('Open error: ' + error)
-        elif not dirlist:
-            self.sb.SetStatusText('Can\'t open ' + url)
-        else:
+                cache.put(host, dir, alllist)
+                store.save(host, dir, alllist)
+                wx.CallAfter(self.populated, task, '', alllist)
+                return
 
-            # Build the list of returned entries
-            Entries.build(self.host, self.dir, dirlist)
+            def lines():
+                # Read lines from ftp server, stopping if superseded
+                for line in fetchiter(url):
+                    if task.cancelled:
+                        return
+                    count[0] += 1
+                    yield line
+
+            def progress(batch):
+                # Post new entries to the gui
+                if progressive:
+                    wx.CallAfter(self.addRows, task, batch)
+
+            # Fetch dir listing from ftp server, building the list of
+            # returned entries as they arrive
+            activity.begin()
+            try:
+                entries = Entries(host, dir)
+                alllist = entries.build(lines(), progress)
+            except Exception, error:
+                if not task.cancelled:
+                    wx.CallAfter(self.populated, task, 'Open error: ' +
+                            str(error))
+                return
+            finally:
+                activity.end()
 
-            # Insert in listctrl
-            for x in Entries.alllist:
+            if task.cancelled:
+                return
 
-                # Add file or dir icon
-                if x.path:
-                    icon = self.file_norm
-                elif x.up:
-                    icon = self.dir_up
-                else:
-                    icon = self.dir_norm
+            if not count[0]:
+                wx.CallAfter(self.populated, task, 'Can\'t open ' + url)
+                return
 
-                ind = self.list.InsertImageStringItem(sys.maxint, x.display,
-                        icon)
-                self.list.SetStringItem(ind, 1, x.datestr)
-                self.list.SetStringItem(ind, 2, x.size)
-                item = self.list.GetItem(ind)
+            for phase, secs in zip(('list.transfer', 'list.parse',
+                    'list.sort'), entries.times):
+                timings.add(phase, secs, dir=dir, count=count[0])
 
-                # Highlight any current recording in progress and
-                # distinguish files by colour
-                if x.size == 'RECORDING':
-                    item.SetTextColour(wx.RED)
-                elif x.path:
-                    item.SetTextColour(wx.BLUE)
+            cache.put(host, dir, alllist)
+            store.save(host, dir, alllist)
+            wx.CallAfter(self.populated, task, '', alllist)
 
-                self.list.SetItem(item)
+        def changed(self, host, dir):
+            '''Called in gui thread when daemon tells us a dir has changed'''
+            cache.expire(host, dir)
+            if (host, dir) == (self.host, self.dir) and not self.task:
+                self.populate()
 
-            self.sb.SetStatusText('')
+        def addRows(self, task, entries):
+            '''Called in gui thread to append new entries as they arrive.
+            They are only sorted, probed and monitored once the listing is
+            complete.'''
+            if task is not self.task:
+                return
 
-        self.parent.SetFocus()
-        self.list.resizeLastColumn(40)
-        self.Enable()
+            # Virtual listctrl draws rows directly from our entries
+            self.list.addEntries(entries)
 
-class MyFrame(wx.Frame):
-    '''Main Wx window'''
-    def __init__(self):
-        '''Constructor'''
-        wx.Frame.__init__(self, None, -1, NAME, size=(720, 720))
-
-        # Add menubar and status bar
-        self.createMenuBar()
-        self.sb = self.CreateStatusBar()
-
-        # Create main panel where the action happens
-        self.panel = MyPanel(self)
-
-    def createMenuBar(self):
-        '''Set up menus in menubar'''
-        menubar = wx.MenuBar()
-
-        # Set up File menu
-        file = wx.Menu()
-        #file.AppendSeparator()
-        file.Append(wx.ID_CLOSE, '&Close', 'Close the program')
-        self.Bind(wx.EVT_MENU, self.closeDown, id=wx.ID_CLOSE)
-        menubar.Append(file, '&File ')
-
-        # Set up Help menu
-        help = wx.Menu()
-        #help.AppendSeparator()
-        help.Append(wx.ID_ABOUT, '&About', 'Information about this program')
-        self.Bind(wx.EVT_MENU, self.onAbout, id=wx.ID_ABOUT)
-        menubar.Append(help, '&Help ')
-
-        self.SetMenuBar(menubar)
-
-    def closeDown(self, e):
-        '''Called to exit this gui program'''
-        self.Close()
-
-    def onAbout(self, e):
-        '''Generate an about box'''
-        info = wx.AboutDialogInfo()
-        info.SetName(NAME)
-        info.SetDescription(DESCRIPTION)
-
-        info.SetVersion(VERSION)
-        info.SetCopyright(COPYRIGHT)
-        info.SetLicence(LICENCE)
-        info.AddDeveloper(AUTHOR)
-        wx.AboutBox(info)
-
-class MyApp(wx.App):
-    def OnInit(self):
-        frame = MyFrame()
-        #frame.Center()
-        frame.Show()
-        return True
+        def populated(self, task, error, entries=None):
+            '''Called in gui thread when population has finished'''
+            if task is not self.task:
+                return
+
+            # Apply new listing, only redrawing rows which have changed
+            self.task = None
+            if not error:
+                self.show(entries)
+                prefetcher.prefetch(self.host, entries)
+                timings.since('populate', self.started, dir=self.dir)
+            self.sb.SetStatusText(error)
+            self.parent.SetFocus()
+
+    class LibraryDialog(wx.Dialog):
+        '''Dialog to search the index of all recordings on the PVR'''
+        def __init__(self, parent, panel):
+            '''Constructor'''
+            wx.Dialog.__init__(self, parent, -1, 'Library', size=(720, 520),
+                    style=wx.DEFAULT_DIALOG_STYLE|wx.RESIZE_BORDER)
+            self.panel = panel
+            self.indexer = panel.getIndexer()
+            self.found = []
+
+            vbox = wx.BoxSizer(wx.VERTICAL)
+
+            # Search:
+            hbox1 = wx.BoxSizer(wx.HORIZONTAL)
+            findlabel = wx.StaticText(self, -1, 'Find :')
+            self.findent = wx.TextCtrl(self, -1, '')
+            self.findent.Bind(wx.EVT_TEXT, self.update)
+            hbox1.Add(findlabel, 0, wx.RIGHT|wx.ALIGN_CENTER_VERTICAL, 6)
+            hbox1.Add(self.findent, 1, wx.EXPAND)
+            vbox.Add(hbox1, 0, wx.ALL|wx.EXPAND, 10)
+
+            # List of matching recordings
+            self.list = AWListCtrl(self, style=wx.LC_REPORT|wx.LC_VIRTUAL|
+                    wx.SUNKEN_BORDER|wx.LC_SINGLE_SEL|wx.LC_HRULES|
+                    wx.LC_VRULES)
+            self.list.columns = ('display', 'datestr', 'size', 'path')
+            self.list.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.goto)
+            self.list.InsertColumn(0, 'Name', width=260)
+            self.list.InsertColumn(1, 'Date/Time', width=160)
+            self.list.InsertColumn(2, 'Size (MB)', format=wx.LIST_FORMAT_RIGHT)
+            self.list.InsertColumn(3, 'Path')
+            vbox.Add(self.list, 1, wx.LEFT|wx.RIGHT|wx.EXPAND, 10)
+
+            self.summary = wx.StaticText(self, -1, '')
+            vbox.Add(self.summary, 0, wx.ALL|wx.EXPAND, 10)
+
+            # Bottom buttons
+            hbox2 = wx.BoxSizer(wx.HORIZONTAL)
+
+            btngo = wx.Button(self, -1, '&Go To', size=BUTTON_SIZE)
+            btngo.Bind(wx.EVT_BUTTON, self.goto)
+            hbox2.Add(btngo, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            self.btnscan = wx.Button(self, -1, 'Re&scan', size=BUTTON_SIZE)
+            self.btnscan.Bind(wx.EVT_BUTTON, self.rescan)
+            hbox2.Add(self.btnscan, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btnclo = wx.Button(self, wx.ID_CLOSE, size=BUTTON_SIZE)
+            btnclo.Bind(wx.EVT_BUTTON, lambda e: self.Destroy())
+            hbox2.Add(btnclo, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            vbox.Add(hbox2, 0, wx.ALIGN_CENTER, 10)
+            self.SetSizer(vbox)
+
+            self.update()
+            if not self.indexer.dirs:
+                self.rescan()
+
+        def update(self, e=None):
+            '''Update list of recordings matching search text'''
+            self.found = self.indexer.find(self.findent.GetValue())
+            self.list.setEntries(self.found)
+            self.list.resizeLastColumn(40)
+
+            total = sum(x.bytes for x in self.indexer.recordings())
+            self.summary.SetLabel('%d of %d recordings in %d directories, '
+                    '%.1f GB total' % (len(self.found),
+                        len(self.indexer.recordings()), len(self.indexer.dirs),
+                        total / (1024. ** 3)))
+
+        def rescan(self, e=None):
+            '''Start background crawl of library'''
+            self.btnscan.Disable()
+            self.summary.SetLabel('Scanning ..')
+            Task(self.scanTask)
+
+        def scanTask(self, task):
+            '''Background thread to crawl library'''
+            def progress(done, total):
+                wx.CallAfter(self.scanned, 'Scanned %d of %d directories ..' %
+                        (done, total))
+
+            errors = self.indexer.crawl(progress, task)
+            wx.CallAfter(self.scanned, '; '.join(errors), True)
+
+        def scanned(self, msg, finished=False):
+            '''Called in gui thread with crawl progress'''
+
+            # Dialog may have been closed while crawling
+            if not self:
+                return
+
+            if finished:
+                self.btnscan.Enable()
+                self.update()
+                if msg:
+                    self.summary.SetLabel('Scan error: ' + msg)
+            else:
+                self.summary.SetLabel(msg)
+
+        def goto(self, e):
+            '''Show directory of selected recording in main window'''
+            index = self.list.GetFirstSelected()
+            if index >= 0:
+                self.panel.goto(self.found[index].path)
+
+    class DuplicatesDialog(wx.Dialog):
+        '''Dialog to find and delete recordings stored more than once on
+        the PVR'''
+        def __init__(self, parent, panel):
+            '''Constructor'''
+            wx.Dialog.__init__(self, parent, -1, 'Duplicates', size=(720, 520),
+                    style=wx.DEFAULT_DIALOG_STYLE|wx.RESIZE_BORDER)
+            self.panel = panel
+            self.indexer = panel.getIndexer()
+            self.sets = []
+            self.rows = []
+
+            vbox = wx.BoxSizer(wx.VERTICAL)
+
+            # Each set of duplicates, under a heading row
+            self.list = AWListCtrl(self, style=wx.LC_REPORT|wx.LC_VIRTUAL|
+                    wx.SUNKEN_BORDER|wx.LC_HRULES|wx.LC_VRULES)
+            self.list.columns = ('display', 'datestr', 'size', 'path')
+            self.list.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.goto)
+            self.list.InsertColumn(0, 'Name', width=260)
+            self.list.InsertColumn(1, 'Date/Time', width=160)
+            self.list.InsertColumn(2, 'Size (MB)', format=wx.LIST_FORMAT_RIGHT)
+            self.list.InsertColumn(3, 'Path')
+            vbox.Add(self.list, 1, wx.ALL|wx.EXPAND, 10)
+
+            self.summary = wx.StaticText(self, -1, '')
+            vbox.Add(self.summary, 0, wx.LEFT|wx.RIGHT|wx.BOTTOM|wx.EXPAND, 10)
+
+            # Bottom buttons
+            hbox = wx.BoxSizer(wx.HORIZONTAL)
+
+            btngo = wx.Button(self, -1, '&Go To', size=BUTTON_SIZE)
+            btngo.Bind(wx.EVT_BUTTON, self.goto)
+            hbox.Add(btngo, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btnext = wx.Button(self, -1, 'Select &Extra', size=BUTTON_SIZE)
+            btnext.Bind(wx.EVT_BUTTON, self.selectExtra)
+            hbox.Add(btnext, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btndel = wx.Button(self, -1, '&Delete', size=BUTTON_SIZE)
+            btndel.Bind(wx.EVT_BUTTON, self.delete)
+            hbox.Add(btndel, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            self.btnscan = wx.Button(self, -1, 'Re&scan', size=BUTTON_SIZE)
+            self.btnscan.Bind(wx.EVT_BUTTON, self.rescan)
+            hbox.Add(self.btnscan, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btnclo = wx.Button(self, wx.ID_CLOSE, size=BUTTON_SIZE)
+            btnclo.Bind(wx.EVT_BUTTON, self.close)
+            hbox.Add(btnclo, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            vbox.Add(hbox, 0, wx.ALIGN_CENTER, 10)
+            self.SetSizer(vbox)
+            self.Bind(wx.EVT_CLOSE, self.close)
+
+            # Only crawl the library if it has not been yet
+            self.rescan(crawl=not self.indexer.dirs)
+
+        def close(self, e):
+            '''Stop any scan and close'''
+            self.task.cancel()
+            self.Destroy()
+
+        def update(self):
+            '''Show current sets of duplicates'''
+            self.rows = []
+            for i, dups in enumerate(self.sets):
+                self.rows.append(Entry.makedir('#%d' % i,
+                    '%d copies of %s MB' % (len(dups), dups[0].size)))
+                self.rows.extend(dups)
+            self.list.setEntries(self.rows)
+            self.list.resizeLastColumn(40)
+
+            extra = sum(x.bytes for dups in self.sets for x in dups[1:])
+            self.summary.SetLabel('%d recordings stored more than once, '
+                    '%.1f GB in extra copies' % (len(self.sets),
+                        extra / (1024. ** 3)))
+
+        def rescan(self, e=None, crawl=True):
+            '''Start background crawl of library and search for
+            duplicates'''
+            self.btnscan.Disable()
+            self.summary.SetLabel('Scanning ..')
+            self.task = Task(self.scanTask, crawl)
+
+        def scanTask(self, task, crawl):
+            '''Background thread to crawl library and sample candidate
+            duplicates'''
+            errors = []
+            if crawl:
+                def crawled(done, total):
+                    wx.CallAfter(self.scanned, 'Scanned %d of %d '
+                            'directories ..' % (done, total))
+                errors = self.indexer.crawl(crawled, task)
+
+            def sampled(done, total):
+                wx.CallAfter(self.scanned, 'Sampled %d of %d recordings of '
+                        'the same size ..' % (done, total))
+
+            sets, errs = duplicates(self.indexer.host,
+                    self.indexer.recordings(), sampled, task)
+            if not task.cancelled:
+                wx.CallAfter(self.scanned, '; '.join(errors + errs), sets)
+
+        def scanned(self, msg, sets=None):
+            '''Called in gui thread with scan progress'''
+
+            # Dialog may have been closed while scanning
+            if not self:
+                return
+
+            if sets is not None:
+                self.btnscan.Enable()
+                self.sets = sets
+                self.update()
+                if msg:
+                    self.summary.SetLabel('Scan error: ' + msg)
+            else:
+                self.summary.SetLabel(msg)
+
+        def selected(self):
+            '''Return list of selected recordings'''
+            entries = []
+            index = self.list.GetFirstSelected()
+            while 0 <= index < len(self.rows):
+                if self.rows[index].path:
+                    entries.append(self.rows[index])
+                index = self.list.GetNextSelected(index)
+            return entries
+
+        def selectExtra(self, e):
+            '''Select all but the oldest copy in each set'''
+            extra = set(x.path for dups in self.sets for x in dups[1:])
+            for i, x in enumerate(self.rows):
+                self.list.Select(i, x.path in extra)
+
+        def goto(self, e):
+            '''Show directory of selected recording in main window'''
+            entries = self.selected()
+            if entries:
+                self.panel.goto(entries[0].path)
+
+        def delete(self, e):
+            '''Delete selected recordings'''
+            paths = [x.path for x in self.selected()]
+            if not paths:
+                return
+
+            message = 'Are you sure to delete these %d files from %s?' \
+                    '\n\n%s' % (len(paths), self.indexer.host,
+                            self.panel.summary(['/' + p for p in paths]))
+
+            # Warn if no copy of some recording would be left
+            gone = set(paths)
+            lost = len([dups for dups in self.sets
+                if all(x.path in gone for x in dups)])
+            if lost:
+                message += '\n\nThis deletes every copy of %d ' \
+                        'recording[s].' % lost
+
+            if not self.panel.confirm(message, 'Confirm Delete'):
+                return
+
+            self.summary.SetLabel('Deleting %d file[s]' % len(paths))
+            Task(self.deleteTask, self.indexer.host, paths)
+
+        def deleteTask(self, task, host, paths):
+            '''Background thread to delete recordings over one session'''
+            start = time.time()
+            errors = delete(host, paths, self.panel.pipeline)
+            timings.since('delete', start, count=len(paths))
+            done = [p for p, e in zip(paths, errors) if not e]
+
+            dirs = {}
+            for p in done:
+                dirs.setdefault(dirname('/' + p), []).append(p)
+            for dir, dirpaths in dirs.items():
+                self.panel.uncache(host, dir, dirpaths)
+            self.indexer.remove(done)
+            wx.CallAfter(self.deleted, host, dirs.keys(), paths, errors)
+
+        def deleted(self, host, dirs, paths, errors):
+            '''Called in gui thread when a delete has completed'''
+            for dir in dirs:
+                self.panel.updated(host, dir)
+            self.panel.report('Deleted', [basename('/' + p) for p in paths],
+                    errors)
+
+            # Dialog may have been closed while deleting
+            if not self:
+                return
+
+            gone = set(p for p, e in zip(paths, errors) if not e)
+            sets = [[x for x in dups if x.path not in gone]
+                    for dups in self.sets]
+            self.sets = [dups for dups in sets if len(dups) > 1]
+            self.update()
+
+    class DiagnosticsDialog(wx.Dialog):
+        '''Dialog to show how long each phase of recent operations took,
+        and to capture a profile'''
+        def __init__(self, parent):
+            '''Constructor'''
+            wx.Dialog.__init__(self, parent, -1, 'Diagnostics',
+                    size=(560, 460),
+                    style=wx.DEFAULT_DIALOG_STYLE|wx.RESIZE_BORDER)
+            self.sb = parent.sb
+
+            vbox = wx.BoxSizer(wx.VERTICAL)
+
+            # Timings of each phase
+            self.list = AWListCtrl(self, style=wx.LC_REPORT|wx.SUNKEN_BORDER|
+                    wx.LC_SINGLE_SEL|wx.LC_HRULES|wx.LC_VRULES)
+            self.list.InsertColumn(0, 'Phase', width=160)
+            for i, title in enumerate(('Count', 'p50 (ms)', 'p95 (ms)',
+                'Max (ms)')):
+                self.list.InsertColumn(i + 1, title, width=85,
+                        format=wx.LIST_FORMAT_RIGHT)
+            vbox.Add(self.list, 1, wx.ALL|wx.EXPAND, 10)
+
+            self.trace = wx.CheckBox(self, -1, 'Trace timings to ' +
+                    self.tracefile())
+            self.trace.SetValue(bool(timings.trace))
+            self.trace.Bind(wx.EVT_CHECKBOX, self.onTrace)
+            vbox.Add(self.trace, 0, wx.LEFT|wx.RIGHT|wx.BOTTOM, 10)
+
+            # Bottom buttons
+            hbox = wx.BoxSizer(wx.HORIZONTAL)
+
+            btnref = wx.Button(self, -1, '&Refresh', size=BUTTON_SIZE)
+            btnref.Bind(wx.EVT_BUTTON, self.update)
+            hbox.Add(btnref, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btnres = wx.Button(self, -1, 'R&eset', size=BUTTON_SIZE)
+            btnres.Bind(wx.EVT_BUTTON, self.reset)
+            hbox.Add(btnres, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            self.btnprof = wx.Button(self, -1, '', size=BUTTON_SIZE)
+            self.btnprof.Bind(wx.EVT_BUTTON, self.onProfile)
+            hbox.Add(self.btnprof, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            btnclo = wx.Button(self, wx.ID_CLOSE, size=BUTTON_SIZE)
+            btnclo.Bind(wx.EVT_BUTTON, lambda e: self.Destroy())
+            hbox.Add(btnclo, 0, wx.LEFT|wx.BOTTOM, 5)
+
+            vbox.Add(hbox, 0, wx.ALIGN_CENTER, 10)
+            self.SetSizer(vbox)
+            self.update()
+
+        @staticmethod
+        def tracefile():
+            '''Return file timings are traced to'''
+            if timings.trace:
+                return timings.trace.name
+            return os.path.join(get_default_cachedir(), 'trace.jsonl')
+
+        @staticmethod
+        def profilefile():
+            '''Return file profile is saved to'''
+            return os.path.join(get_default_cachedir(), 'profile.pstats')
+
+        def update(self, e=None):
+            '''Show current timings'''
+            self.list.DeleteAllItems()
+            for phase, count, p50, p95, max in timings.stats():
+                ind = self.list.InsertStringItem(sys.maxint, phase)
+                self.list.SetStringItem(ind, 1, str(count))
+                for i, secs in enumerate((p50, p95, max)):
+                    self.list.SetStringItem(ind, i + 2, '%.1f' % (secs * 1000))
+
+            self.btnprof.SetLabel('Stop &Profile' if profiler.main else
+                    '&Profile')
+
+        def reset(self, e):
+            '''Discard timings so far'''
+            timings.reset()
+            self.update()
+
+        def onTrace(self, e):
+            '''Start or stop tracing timings'''
+            try:
+                if self.trace.GetValue():
+                    if not os.path.isdir(os.path.dirname(self.tracefile())):
+                        os.makedirs(os.path.dirname(self.tracefile()))
+                    timings.tracefile(self.tracefile())
+                else:
+                    timings.tracefile(None)
+            except (IOError, OSError), error:
+                self.trace.SetValue(False)
+                self.sb.SetStatusText('Trace error: ' + str(error))
+
+        def onProfile(self, e):
+            '''Start or stop profiling'''
+            if not profiler.main:
+                profiler.start()
+                self.sb.SetStatusText('Profiling ..')
+            else:
+                file = self.profilefile()
+                try:
+                    if not os.path.isdir(os.path.dirname(file)):
+                        os.makedirs(os.path.dirname(file))
+                    profiler.stop(file)
+                    self.sb.SetStatusText('Saved profile to ' + file)
+                except (IOError, OSError), error:
+                    self.sb.SetStatusText('Profile error: ' + str(error))
+
+            self.update()
+
+    class MyFrame(wx.Frame):
+        '''Main Wx window'''
+        def __init__(self):
+            '''Constructor'''
+            wx.Frame.__init__(self, None, -1, NAME, size=(720, 720))
+
+            # Add menubar and status bar
+            self.createMenuBar()
+            self.sb = self.CreateStatusBar()
+
+            # Create main panel where the action happens
+            self.panel = MyPanel(self)
+
+        def createMenuBar(self):
+            '''Set up menus in menubar'''
+            menubar = wx.MenuBar()
+
+            # Set up File menu
+            file = wx.Menu()
+            #file.AppendSeparator()
+            file.Append(wx.ID_CLOSE, '&Close', 'Close the program')
+            self.Bind(wx.EVT_MENU, self.closeDown, id=wx.ID_CLOSE)
+            menubar.Append(file, '&File ')
+
+            # Set up Tools menu
+            tools = wx.Menu()
+            library = tools.Append(-1, '&Library', 'Search all recordings')
+            self.Bind(wx.EVT_MENU, self.onLibrary, library)
+            dups = tools.Append(-1, 'D&uplicates',
+                    'Find recordings stored more than once')
+            self.Bind(wx.EVT_MENU, self.onDuplicates, dups)
+            diags = tools.Append(-1, '&Diagnostics',
+                    'Show timings of recent operations')
+            self.Bind(wx.EVT_MENU, self.onDiagnostics, diags)
+            menubar.Append(tools, '&Tools ')
+
+            # Set up Help menu
+            help = wx.Menu()
+            #help.AppendSeparator()
+            help.Append(wx.ID_ABOUT, '&About',
+                    'Information about this program')
+            self.Bind(wx.EVT_MENU, self.onAbout, id=wx.ID_ABOUT)
+            menubar.Append(help, '&Help ')
+
+            self.SetMenuBar(menubar)
+
+        def closeDown(self, e):
+            '''Called to exit this gui program'''
+            self.Close()
+
+        def onLibrary(self, e):
+            '''Show library dialog'''
+            LibraryDialog(self, self.panel).Show()
+
+        def onDuplicates(self, e):
+            '''Show duplicates dialog'''
+            DuplicatesDialog(self, self.panel).Show()
+
+        def onDiagnostics(self, e):
+            '''Show diagnostics dialog'''
+            DiagnosticsDialog(self).Show()
+
+        def onAbout(self, e):
+            '''Generate an about box'''
+            info = wx.AboutDialogInfo()
+            info.SetName(NAME)
+            info.SetDescription(DESCRIPTION)
+
+            info.SetVersion(VERSION)
+            info.SetCopyright(COPYRIGHT)
+            info.SetLicence(LICENCE)
+            info.AddDeveloper(AUTHOR)
+            wx.AboutBox(info)
+
+    class MyApp(wx.App):
+        def OnInit(self):
+            frame = MyFrame()
+            #frame.Center()
+            frame.Show()
+            return True
 
-if __name__ == '__main__':
     app = MyApp(False)
     app.MainLoop()